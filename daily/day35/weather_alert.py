@@ -3,9 +3,8 @@ import logging
 import os
 from typing import List, NamedTuple
 
-import requests
-
 from tools.consts import OPENWEATHER_CREDS, TWILIO_CREDS
+from tools.http_client import get_client
 from tools.utils import BaseCreds, TwilioTextSender
 
 APP_NAME = os.path.basename(__file__).replace(".py", "")
@@ -53,7 +52,7 @@ class WeatherAlerter:
 
     def query_hourly_weather(self):
         skip_part = ",".join(["current", "minutely", "daily"])
-        response = requests.get(
+        response = get_client().get(
             f"https://api.openweathermap.org/data/2.5/onecall?lat={self._lat}"
             f"&lon={self._lon}&exclude={skip_part}"
             f"&appid={self._weather_creds.api_key}&units=metric"
@@ -1,12 +1,17 @@
 import datetime as dt
 import logging
 import os
-from typing import Dict, List, NamedTuple
-
-import requests
+from typing import Any, Dict, List, NamedTuple, Optional, Union
 
 from tools.consts import FINNHUB_CREDS, TWILIO_CREDS
-from tools.services import SynchronousService
+from tools.http_client import get_client
+from tools.notifications import NotificationDispatcher
+from tools.services import (
+    ActiveWindow,
+    AdaptiveInterval,
+    CheckpointStore,
+    SynchronousService,
+)
 from tools.utils import BaseCreds, TwilioTextSender
 
 APP_NAME = os.path.basename(__file__).replace(".py", "")
@@ -22,6 +27,20 @@ CONFIG = {
     "ticker": "TSLA",
     "twilio_creds_loc": TWILIO_CREDS,
     "threshold": 0.03,
+    "api_budget": 500,  # finnhub calls per day
+    "checkpoint_loc": os.path.join(os.path.dirname(__file__), f"{APP_NAME}.ckpt"),
+    # regular NYSE session, quotes do not move outside of it
+    "trading_hours": {
+        "start": "09:30",
+        "end": "16:00",
+        "weekdays": [0, 1, 2, 3, 4],
+        "tz": "America/New_York",
+        # NYSE holidays, published a year or more ahead; extend the file yearly,
+        # the window logs a warning once its calendar runs past the last year
+        "holidays_file": os.path.join(
+            os.path.dirname(__file__), "market_holidays.json"
+        ),
+    },
 }
 
 
@@ -52,14 +71,19 @@ class StockPriceMonitor(SynchronousService):
     """
 
     DEFAULT_THRESHOLD = 0.03
+    MIN_INTERVAL = 60  # poll every minute when right at the threshold
+    MAX_INTERVAL = 3600  # a flat morning must not back off past the close
 
     def __init__(
         self,
         ticker: str,
         finnhub_creds: FinnhubCreds,
-        text_sender: TwilioTextSender,
+        text_sender: Union[TwilioTextSender, NotificationDispatcher],
         news_alert: bool = True,
         threshold: float = DEFAULT_THRESHOLD,
+        api_budget: Optional[int] = None,
+        checkpoint_loc: Optional[str] = None,
+        trading_hours: Optional[ActiveWindow] = None,
     ):
         self.text_sender = text_sender
         self._ticker = ticker
@@ -68,15 +92,41 @@ class StockPriceMonitor(SynchronousService):
         self._threshold = threshold
         self._news_alert = news_alert
         self._news_cache = {}  # track news we have seen already
+        self.interval_policy = AdaptiveInterval(
+            self.MIN_INTERVAL,
+            self.DEFAULT_INTERVAL,
+            self.MAX_INTERVAL,
+            budget=api_budget,
+        )
+        if checkpoint_loc:
+            self.checkpoint = CheckpointStore(checkpoint_loc)
+        self.active_window = trading_hours
 
     @classmethod
     def from_serializable(cls, config: Dict):
         ticker = config["ticker"]
         finnhub_creds = FinnhubCreds.from_json_file(config["finnhub_creds_loc"])
-        text_sender = TwilioTextSender.from_creds_file(config["twilio_creds_loc"])
+        # alerts go out in the background, near identical ones are coalesced
+        text_sender = NotificationDispatcher(
+            TwilioTextSender.from_creds_file(config["twilio_creds_loc"])
+        )
         news_alert = config.get("news_alert") or True
         threshold = config.get("threshold") or cls.DEFAULT_THRESHOLD
-        return cls(ticker, finnhub_creds, text_sender, news_alert, threshold)
+        api_budget = config.get("api_budget")
+        checkpoint_loc = config.get("checkpoint_loc")
+        trading_hours = config.get("trading_hours")
+        if trading_hours:
+            trading_hours = ActiveWindow.from_serializable(trading_hours)
+        return cls(
+            ticker,
+            finnhub_creds,
+            text_sender,
+            news_alert,
+            threshold,
+            api_budget,
+            checkpoint_loc,
+            trading_hours,
+        )
 
     def run(self):
         """
@@ -87,20 +137,41 @@ class StockPriceMonitor(SynchronousService):
         """
         logger.info(f"checking price for {self._ticker}")
         self._quote = self.load_quote(self._ticker, self._creds.api_key)
+        calls = 1
         if self.is_alert_move(self._quote, self._threshold):
             self.send_alert()
+            calls += self._news_alert
+            # already alerted, treat the trigger as far away so a sustained move
+            # is re-alerted at the base interval, not at every fast poll
+            distance = 1.0
         else:
             logger.info(f"no alert-worthy movements observed for {self._ticker}")
+            # poll faster the closer the move gets to the threshold
+            distance = 1 - abs(self._quote.move) / self._threshold
+        self.interval_policy.observe(distance, calls)
 
     def stop(self):
         # no state to cleanup, simply exit program
         quit()
 
+    def get_state(self) -> Dict[str, Any]:
+        # one entry per news item so a checkpoint only appends the new ones
+        return {
+            f"news/{n.id}": {**n._asdict(), "dt": n.dt.isoformat()}
+            for n in self._news_cache.values()
+        }
+
+    def set_state(self, state: Dict[str, Any]):
+        for key, data in state.items():
+            if key.startswith("news/"):
+                news = NewsData(**{**data, "dt": dt.datetime.fromisoformat(data["dt"])})
+                self._news_cache[news.id] = news
+
     @staticmethod
     def load_quote(ticker, api_key) -> QuoteData:
         """ check finnhub API: https://finnhub.io/docs/api#quote
         """
-        r = requests.get(
+        r = get_client().get(
             f"https://finnhub.io/api/v1/quote?symbol={ticker}&token={api_key}"
         )
         r.raise_for_status()
@@ -131,7 +202,7 @@ class StockPriceMonitor(SynchronousService):
         """ retrieves all the news on the day
         """
         day = dt.date.today().strftime("%Y-%m-%d")
-        r = requests.get(
+        r = get_client().get(
             f"https://finnhub.io/api/v1/company-news?symbol={ticker}&token={api_key}&from={day}&to={day}"
         )
         r.raise_for_status()
@@ -10,10 +10,10 @@ from functools import wraps
 from itertools import chain
 from typing import Dict, Optional
 
-import requests
 from typing_extensions import Literal
 
 from tools.consts import PIXELA_CREDS
+from tools.http_client import get_client
 from tools.utils import read_json_file, write_json_file
 
 APP_NAME = os.path.basename(__file__).replace(".py", "")
@@ -118,7 +118,7 @@ class PixelaManager:
     @staticmethod
     def activate_pixela(username: str):
         token = str(uuid.uuid4())
-        r = requests.post(
+        r = get_client().post(
             "https://pixe.la/v1/users",
             json={
                 "username": username,
@@ -132,7 +132,7 @@ class PixelaManager:
 
     @staticmethod
     def decativate_pixela(username: str, token: str):
-        r = requests.delete(
+        r = get_client().delete(
             f"https://pixe.la/v1/users/{username}", headers={"X-USER-TOKEN": token}
         )
         response = json.loads(r.text)
@@ -150,7 +150,7 @@ class PixelaManager:
         """ check https://docs.pixe.la/entry/post-graph
         """
         graph_id = PixelaManager.random_graph_id()
-        r = requests.post(
+        r = get_client().post(
             f"https://pixe.la/v1/users/{username}/graphs",
             headers={"X-USER-TOKEN": token},
             json={
@@ -172,7 +172,7 @@ class PixelaManager:
     def delete_graph(username: str, token: str, graph_id: str):
         """ check https://docs.pixe.la/entry/delete-graph
         """
-        r = requests.delete(
+        r = get_client().delete(
             f"https://pixe.la/v1/users/{username}/graphs/{graph_id}",
             headers={"X-USER-TOKEN": token},
         )
@@ -185,7 +185,7 @@ class PixelaManager:
 
     @staticmethod
     def add_pixel(username: str, token: str, graph_id: str, pixel: Pixel):
-        r = requests.post(
+        r = get_client().post(
             f"https://pixe.la/v1/users/{username}/graphs/{graph_id}",
             headers={"X-USER-TOKEN": token},
             json=pixel.as_dict(),
@@ -3,12 +3,11 @@ import json
 import logging
 import os
 from dataclasses import dataclass
-from typing import Dict, List, Optional
-
-import requests
+from typing import Dict, List, Optional, Union
 
 from tools.consts import KIWI_CREDS, SHEETY_CREDS, TWILIO_CREDS
-from tools.utils import BaseCreds, SheetyHandler, TwilioTextSender
+from tools.http_client import get_client
+from tools.utils import BaseCreds, SheetyHandler, SheetyMirror, TwilioTextSender
 
 APP_NAME = os.path.basename(__file__).replace(".py", "")
 logger = logging.getLogger(APP_NAME)
@@ -43,7 +42,7 @@ class KiwiHandler:
         from_airport = f"{'city:' if search_by_city else ''}{from_airport}"
         to_airport = f"{'city:' if search_by_city else ''}{to_airport}"
         get_url = f"https://tequila-api.kiwi.com/v2/search?curr={currency}&fly_from={from_airport}&fly_to={to_airport}&dateFrom={start_date:%d/%m/%Y}&dateTo={end_date:%d/%m/%Y}"
-        r = requests.get(url=get_url, headers={"apikey": api_key})
+        r = get_client().get(get_url, headers={"apikey": api_key})
         r.raise_for_status()
         response = json.loads(r.text)
         logger.info(f"queried flight with params {response['search_params']}")
@@ -126,11 +125,12 @@ class CheapFlightFinder:
 
     def __init__(
         self,
-        sheety_handler: SheetyHandler,
+        sheety_handler: Union[SheetyHandler, SheetyMirror],
         twilio_sender: TwilioTextSender,
         kiwi_handler: KiwiHandler,
     ):
-        self.shh: SheetyHandler = sheety_handler
+        # a SheetyMirror serves destinations locally, refreshing them on its ttl
+        self.shh: Union[SheetyHandler, SheetyMirror] = sheety_handler
         self.tws: TwilioTextSender = twilio_sender
         self.kwh: KiwiHandler = kiwi_handler
 
@@ -162,7 +162,10 @@ if __name__ == "__main__":
         format=f"{APP_NAME}[%(levelname)s][%(asctime)s]: %(message)s",
     )
     cff = CheapFlightFinder(
-        SheetyHandler.from_creds_file(SHEETY_CREDS),
+        SheetyMirror(
+            SheetyHandler.from_creds_file(SHEETY_CREDS),
+            os.path.join(os.path.dirname(__file__), "sheety_mirror.db"),
+        ),
         TwilioTextSender.from_creds_file(TWILIO_CREDS),
         KiwiHandler.from_creds_file(KIWI_CREDS),
     )
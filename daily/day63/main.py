@@ -4,7 +4,7 @@ from dataclasses import dataclass
 
 from flask import Flask, render_template, request
 
-from tools.db_utils import SqliteClient, SqliteInfo
+from tools.db_utils import ResultCache, SqliteClient, SqliteConnectionPool, SqliteInfo
 
 ROOT_PATH = os.path.dirname(__file__)
 STATIC_PATH = os.path.join(ROOT_PATH, "static")
@@ -24,30 +24,31 @@ class Book:
 
 app = Flask(APP_NAME, static_folder=STATIC_PATH, template_folder=TEMPLATE_PATH)
 app.secret_key = "ABC"
+db_pool = SqliteConnectionPool.for_db_info(
+    SqliteInfo(DB_LOC), result_cache=ResultCache()
+)
+db_pool.init_app(app)
 
 
 def get_books_from_db(sqlite_client: SqliteClient):
-    rows = sqlite_client.get("library")
-    all_books = []
-    for row in rows:
-        all_books.append(Book(*row))
-    return all_books
+    return sqlite_client.iter_rows(
+        "library", columns=["name", "author", "rating"], record_type=Book
+    )
 
 
 @app.route("/")
 def home():
-    with SqliteClient.from_db_info(SqliteInfo(DB_LOC)) as sqlite_client:
-        return render_template("index.html", books=get_books_from_db(sqlite_client))
+    sqlite_client = db_pool.app_client()
+    return render_template("index.html", books=get_books_from_db(sqlite_client))
 
 
 @app.route("/add", methods=["POST", "GET"])
 def add():
     if request.method == "POST":
         rform = request.form
-        with SqliteClient.from_db_info(SqliteInfo(DB_LOC)) as sqlite_client:
-            sqlite_client.insert(
-                "library", [[rform["name"], rform["author"], rform["rating"]]]
-            )
+        db_pool.app_client().insert(
+            "library", [[rform["name"], rform["author"], rform["rating"]]]
+        )
         return render_template("add.html", success=True)
     return render_template("add.html", success=False)
 
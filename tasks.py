@@ -80,3 +80,11 @@ def develop(ctx):
     for command in commands:
         ctx.run(command)
     print("Package ready for development")
+
+
+@task
+def bench(ctx, sizes="10000,100000,1000000", output="db_bench.json", baseline=None):
+    command = f"python -m tools.db_bench --sizes {sizes} --output {output}"
+    if baseline:
+        command += f" --baseline {baseline}"
+    ctx.run(command, echo=True)
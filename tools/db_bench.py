@@ -0,0 +1,246 @@
+""" Benchmarks for tools.db_utils against synthetic sqlite tables in a temp dir
+
+    python -m tools.db_bench --sizes 10000,100000 --output bench.json
+    python -m tools.db_bench --baseline bench.json  # flag slowdowns vs a stored run
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional
+
+from tools.db_utils import SqliteClient, SqliteConnectionPool, SqliteInfo, batched
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_TOLERANCE = 0.2  # flag runs more than 20% slower than baseline
+SINGLE_ROW_LIMIT = 10_000  # one commit per row, larger sizes take minutes
+CONNECT_REPEATS = 500
+COMMIT_BATCH = 10  # rows per transaction in the journal mode comparison
+TABLE = "library"
+SCHEMA = f"CREATE TABLE {TABLE} (name text, author text, rating float)"
+
+
+def synthetic_rows(n: int) -> Iterator[tuple]:
+    for i in range(n):
+        yield f"book {i}", f"author {i % 997}", (i % 100) / 10
+
+
+def _fresh_db(dir_name: str, name: str, journal_mode: str = "DELETE") -> SqliteInfo:
+    db_file = os.path.join(dir_name, f"{name}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute(SCHEMA)
+    conn.commit()
+    conn.close()
+    return SqliteInfo(db_file)
+
+
+def _timed(fn: Callable[[], int], trace_memory: bool = False) -> Dict[str, float]:
+    """ fn returns the number of rows (or operations) it processed
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    n = fn()
+    seconds = time.perf_counter() - start
+    result = {"seconds": seconds, "rows": n, "rows_per_sec": n / seconds}
+    if trace_memory:
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+# ~~~~~~~~~~~~~~~~ benchmarks ~~~~~~~~~~~~~~~~~~
+def bench_insert_single(tmp_dir: str, n: int) -> Dict[str, float]:
+    n = min(n, SINGLE_ROW_LIMIT)
+    db_info = _fresh_db(tmp_dir, "single")
+
+    def run():
+        with SqliteClient.from_db_info(db_info) as client:
+            for row in synthetic_rows(n):
+                client.insert(TABLE, [row])
+        return n
+
+    return _timed(run)
+
+
+def bench_insert_batched(tmp_dir: str, n: int) -> Dict[str, float]:
+    db_info = _fresh_db(tmp_dir, "batched")
+
+    def run():
+        with SqliteClient.from_db_info(db_info) as client:
+            return client.bulk_insert(TABLE, synthetic_rows(n)).rows
+
+    return _timed(run)
+
+
+def _populated_db(tmp_dir: str, n: int) -> SqliteInfo:
+    db_info = _fresh_db(tmp_dir, "read")
+    with SqliteClient.from_db_info(db_info) as client:
+        client.bulk_insert(TABLE, synthetic_rows(n))
+    return db_info
+
+
+def bench_read_full(db_info: SqliteInfo) -> Dict[str, float]:
+    def run():
+        with SqliteClient.from_db_info(db_info) as client:
+            return len(client.get(TABLE))
+
+    return _timed(run, trace_memory=True)
+
+
+def bench_read_stream(db_info: SqliteInfo) -> Dict[str, float]:
+    def run():
+        with SqliteClient.from_db_info(db_info) as client:
+            return sum(1 for _ in client.iter_rows(TABLE))
+
+    return _timed(run, trace_memory=True)
+
+
+def bench_connect_cold(db_info: SqliteInfo) -> Dict[str, float]:
+    def run():
+        for _ in range(CONNECT_REPEATS):
+            with SqliteClient.from_db_info(db_info) as client:
+                client.get(TABLE, limit=1)
+        return CONNECT_REPEATS
+
+    return _timed(run)
+
+
+def bench_connect_warm(db_info: SqliteInfo) -> Dict[str, float]:
+    pool = SqliteConnectionPool(db_info, max_size=1)
+
+    def run():
+        for _ in range(CONNECT_REPEATS):
+            with pool.client() as client:
+                client.get(TABLE, limit=1)
+        return CONNECT_REPEATS
+
+    try:
+        return _timed(run)
+    finally:
+        pool.close()
+
+
+def bench_small_commits(tmp_dir: str, n: int, journal_mode: str) -> Dict[str, float]:
+    """ many small transactions, where the journal mode matters most
+    """
+    n = min(n, SINGLE_ROW_LIMIT * COMMIT_BATCH)
+    db_info = _fresh_db(tmp_dir, f"journal_{journal_mode.lower()}", journal_mode)
+
+    def run():
+        with SqliteClient.from_db_info(db_info) as client:
+            for batch in batched(synthetic_rows(n), COMMIT_BATCH):
+                client.bulk_insert(TABLE, batch)
+        return n
+
+    return _timed(run)
+
+
+def run_suite(sizes: List[int], tmp_dir: str) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    def record(name: str, result: Dict[str, float]):
+        results[name] = result
+        rate = result["rows_per_sec"]
+        logger.info(f"{name}: {result['seconds']:.3f}s, {rate:,.0f} rows/s")
+
+    db_info = _populated_db(tmp_dir, min(sizes))
+    record("connect_cold", bench_connect_cold(db_info))
+    record("connect_warm", bench_connect_warm(db_info))
+    for n in sizes:
+        record(f"insert_single[n={n}]", bench_insert_single(tmp_dir, n))
+        record(f"insert_batched[n={n}]", bench_insert_batched(tmp_dir, n))
+        db_info = _populated_db(tmp_dir, n)
+        record(f"read_full[n={n}]", bench_read_full(db_info))
+        record(f"read_stream[n={n}]", bench_read_stream(db_info))
+        for mode in ("DELETE", "WAL"):
+            name = f"commits_{mode.lower()}[n={n}]"
+            record(name, bench_small_commits(tmp_dir, n, mode))
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """ names of benchmarks whose throughput fell more than tolerance below baseline
+        raises ValueError when no benchmark is in both, e.g. run with other --sizes
+    """
+    shared = results.keys() & baseline.keys()
+    if not shared:
+        raise ValueError("no benchmark in common with the baseline, check --sizes")
+    regressions = []
+    for name, result in results.items():
+        if name not in shared:
+            logger.warning(f"{name} not in baseline, skipped")
+            continue
+        ratio = result["rows_per_sec"] / baseline[name]["rows_per_sec"]
+        flag = ratio < 1 - tolerance
+        if flag:
+            regressions.append(name)
+        logger.info(f"{'SLOWER' if flag else 'ok':>6} {name}: {ratio:.2f}x baseline")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma separated table sizes, e.g. 10000,10000000",
+    )
+    parser.add_argument("--output", default="db_bench.json")
+    parser.add_argument("--baseline", help="results file of a previous run")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_suite(sizes, tmp_dir)
+    report = {
+        "meta": {
+            "at": dt.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        f.write(json.dumps(report, indent=4))
+    logger.info(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            logger.error(str(e))
+            return 1
+        if regressions:
+            logger.error(f"{len(regressions)} benchmarks regressed: {regressions}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="db_bench[%(levelname)s][%(asctime)s]: %(message)s",
+    )
+    logging.getLogger("tools.db_utils").setLevel(logging.WARNING)
+    sys.exit(main())
@@ -1,11 +1,34 @@
 import abc
-import datetime as dt
+import json
 import logging
+import queue
+import re
 import sqlite3
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, is_dataclass
 from functools import wraps
-from numbers import Number
-from typing import Union
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +57,240 @@ def assert_connected(fn):
     return is_connected
 
 
+class StatementCache:
+    """ Mirrors the LRU of prepared statements sqlite3 keeps per connection
+        (sized by cached_statements) to count how often statement text is reused
+    """
+
+    DEFAULT_SIZE = 128
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._statements: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, sql: str) -> bool:
+        with self._lock:
+            if sql in self._statements:
+                self._statements.move_to_end(sql)
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._statements[sql] = None
+            if len(self._statements) > self.size:
+                self._statements.popitem(last=False)
+            return False
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "cached": len(self._statements),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class Instrument(abc.ABC):
+    """ Hook notified after every statement a DBConnection runs
+        rows is the fetched or affected row count, None when unknown
+    """
+
+    @abc.abstractmethod
+    def on_statement(
+        self,
+        conn: "DBConnection",
+        sql: str,
+        params: Optional[Sequence],
+        seconds: float,
+        rows: Optional[int],
+    ):
+        pass
+
+
+@dataclass
+class StatementStats:
+    histogram: List[int]  # counts per QueryMetrics.BUCKETS latency bucket
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    rows: int = 0
+
+    def as_dict(self):
+        return self.__dict__
+
+
+class QueryMetrics(Instrument):
+    """ Per-statement latency histograms, row counts and a slow-query log
+        Statements are grouped by whitespace-normalized sql, so parameterized
+        queries (see QueryBuilder) aggregate nicely. Statements slower than
+        slow_threshold seconds are logged and, with capture_plans, stored along
+        with their EXPLAIN QUERY PLAN output.
+    """
+
+    # histogram bucket upper bounds in seconds, the last bucket is unbounded
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+    DEFAULT_SLOW_THRESHOLD = 0.1  # seconds
+    DEFAULT_SLOW_LOG_SIZE = 100
+
+    def __init__(
+        self,
+        slow_threshold: float = DEFAULT_SLOW_THRESHOLD,
+        capture_plans: bool = False,
+        slow_log_size: int = DEFAULT_SLOW_LOG_SIZE,
+    ):
+        self.slow_threshold = slow_threshold
+        self.capture_plans = capture_plans
+        self.statements: Dict[str, StatementStats] = {}
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def on_statement(self, conn, sql, params, seconds, rows):
+        key = " ".join(sql.split())
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = StatementStats(histogram=[0] * (len(self.BUCKETS) + 1))
+                self.statements[key] = stats
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows or 0
+            stats.histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        if seconds < self.slow_threshold:
+            return
+        logger.warning(f"slow query ({seconds:.3f}s, {rows} rows): {key}")
+        plan = None
+        if self.capture_plans and params is not None:
+            try:
+                plan = conn.explain(sql, params)
+            except Exception as e:
+                logger.debug(f"could not explain {key}: {e}")
+        with self._lock:
+            self.slow_log.append(
+                {
+                    "sql": key,
+                    "params": repr(params),
+                    "seconds": seconds,
+                    "rows": rows,
+                    "at": time.time(),
+                    "plan": plan,
+                }
+            )
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "buckets": list(self.BUCKETS),
+                "slow_threshold": self.slow_threshold,
+                "statements": {k: v.as_dict() for k, v in self.statements.items()},
+                "slow_log": list(self.slow_log),
+            }
+
+    def dump_json(self, file_loc: str):
+        logger.info(f"writing query metrics to {file_loc}")
+        with open(file_loc, "w") as f:
+            f.write(json.dumps(self.as_dict(), indent=4))
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.slow_log.clear()
+
+
+class RowMapper:
+    """ Compiles sqlite row factories that build records straight from rows
+        Dataclasses and NamedTuples are built through their constructor, classes
+        with __slots__ get their slots assigned without calling __init__. Columns
+        are matched to fields by name and every compiled factory is cached per
+        record type and column names, i.e. once per query shape.
+    """
+
+    _factories: Dict[Tuple[type, Tuple[str, ...]], Callable] = {}
+
+    @staticmethod
+    def _fields(record_type: type) -> Tuple[List[str], bool]:
+        """ field names and whether records are built through the constructor
+        """
+        if is_dataclass(record_type):
+            return [f.name for f in fields(record_type) if f.init], True
+        if issubclass(record_type, tuple) and hasattr(record_type, "_fields"):
+            return list(record_type._fields), True
+        slots = []
+        for klass in record_type.__mro__:
+            klass_slots = klass.__dict__.get("__slots__", ())
+            slots += [klass_slots] if isinstance(klass_slots, str) else klass_slots
+        slots = [s for s in slots if s not in ("__dict__", "__weakref__")]
+        if not slots:
+            raise TypeError(
+                f"{record_type.__name__} must be a dataclass, NamedTuple "
+                "or define __slots__"
+            )
+        return slots, False
+
+    @classmethod
+    def _compile(cls, record_type: type, columns: Tuple[str, ...]) -> Callable:
+        names, via_init = cls._fields(record_type)
+        unknown = set(columns) - set(names)
+        if unknown:
+            raise ValueError(
+                f"columns {sorted(unknown)} have no field on {record_type.__name__}"
+            )
+        new = object.__new__
+        if via_init and list(columns) == names:
+            if issubclass(record_type, tuple):
+                new = tuple.__new__
+                body = ["return _new(_cls, row)"]
+            else:
+                body = ["return _cls(*row)"]
+        elif via_init:
+            kwargs = ", ".join(f"{col}=row[{i}]" for i, col in enumerate(columns))
+            body = [f"return _cls({kwargs})"]
+        else:
+            body = ["obj = _new(_cls)"]
+            body += [f"obj.{col} = row[{i}]" for i, col in enumerate(columns)]
+            body += ["return obj"]
+        source = "def factory(cursor, row):\n    " + "\n    ".join(body)
+        namespace = {"_cls": record_type, "_new": new}
+        exec(source, namespace)
+        return namespace["factory"]
+
+    @classmethod
+    def compile(cls, record_type: type, columns: Sequence[str]) -> Callable:
+        key = (record_type, tuple(columns))
+        factory = cls._factories.get(key)
+        if factory is None:
+            factory = cls._factories[key] = cls._compile(record_type, key[1])
+        return factory
+
+    @classmethod
+    def for_cursor(cls, record_type: type, cur: sqlite3.Cursor) -> Callable:
+        return cls.compile(record_type, [d[0] for d in cur.description])
+
+
 class DBConnection(abc.ABC):
     def __init__(self, db_info: DbInfo):
         self.db_info = db_info
         self.conn = None
         self.connected = False
+        self.instruments: List[Instrument] = []
+
+    def add_instrument(self, instrument: Instrument):
+        self.instruments.append(instrument)
+        return instrument
+
+    def _record(
+        self, sql: str, params: Optional[Sequence], seconds: float, rows: Optional[int],
+    ):
+        for instrument in self.instruments:
+            instrument.on_statement(self, sql, params, seconds, rows)
 
     @abc.abstractmethod
     def connect(self):
@@ -49,13 +301,55 @@ class DBConnection(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def execute(self, sql: str):
+    def execute(self, sql: str, params: Sequence = ()):
         pass
 
     @abc.abstractmethod
-    def fetch(self, sql: str):
+    def executemany(self, sql: str, rows: Iterable[Sequence]):
         pass
 
+    @abc.abstractmethod
+    def fetch(self, sql: str, params: Sequence = (), record_type: type = None):
+        pass
+
+    @abc.abstractmethod
+    def iter_fetch(
+        self,
+        sql: str,
+        params: Sequence = (),
+        chunk_size: int = 1000,
+        record_type: type = None,
+    ):
+        pass
+
+    @abc.abstractmethod
+    def cursor(self, sql: str, params: Sequence = ()):
+        pass
+
+    @abc.abstractmethod
+    def commit(self):
+        pass
+
+    @abc.abstractmethod
+    def rollback(self):
+        pass
+
+    @abc.abstractmethod
+    def transaction(self):
+        pass
+
+    def explain(self, sql: str, params: Sequence = ()) -> List[str]:
+        raise NotImplementedError(f"{self.__class__.__name__} cannot explain queries")
+
+    def tables_read(self, sql: str, params: Sequence = ()) -> Optional[List[str]]:
+        raise NotImplementedError(f"{self.__class__.__name__} cannot attribute reads")
+
+    @property
+    def in_transaction(self) -> bool:
+        """ whether reads may see writes that are not committed yet
+        """
+        return False
+
     def __enter__(self):
         self.connect()
         logger.info(f"{self.__class__.__name__} connected")
@@ -67,9 +361,40 @@ class DBConnection(abc.ABC):
 
 
 class SqliteConnection(DBConnection):
+    _PLAIN_READ = frozenset(
+        {
+            sqlite3.SQLITE_SELECT,
+            sqlite3.SQLITE_READ,
+            sqlite3.SQLITE_FUNCTION,
+            sqlite3.SQLITE_RECURSIVE,
+        }
+    )
+
+    def __init__(
+        self,
+        db_info: DbInfo,
+        check_same_thread: bool = True,
+        cached_statements: int = StatementCache.DEFAULT_SIZE,
+        read_only: bool = False,
+    ):
+        super().__init__(db_info)
+        # pooled connections are handed between threads, one at a time
+        self.check_same_thread = check_same_thread
+        self.statement_cache = StatementCache(cached_statements)
+        self.read_only = read_only
+        self._tx_depth = 0  # open transaction() scopes
+
     def connect(self):
         if not self.connected:
-            self.conn = sqlite3.connect(self.db_info.url)
+            url, uri = self.db_info.url, False
+            if self.read_only:
+                url, uri = Path(url).absolute().as_uri() + "?mode=ro", True
+            self.conn = sqlite3.connect(
+                url,
+                check_same_thread=self.check_same_thread,
+                cached_statements=self.statement_cache.size,
+                uri=uri,
+            )
             self.connected = True
 
     def disconnect(self):
@@ -77,18 +402,179 @@ class SqliteConnection(DBConnection):
             self.conn.close()
             self.connected = False
 
+    @property
+    def in_transaction(self) -> bool:
+        return self.connected and (bool(self._tx_depth) or self.conn.in_transaction)
+
     @assert_connected
-    def execute(self, sql: str) -> int:
+    def execute(self, sql: str, params: Sequence = ()) -> int:
+        self.statement_cache.touch(sql)
+        start = time.perf_counter()
         cur = self.conn.cursor()
-        cur.execute(sql)
-        self.conn.commit()
+        cur.execute(sql, params)
+        if not self._tx_depth:
+            self.conn.commit()
+        self._record(sql, params, time.perf_counter() - start, cur.rowcount)
         return cur.lastrowid
 
     @assert_connected
-    def fetch(self, sql: str) -> list:
+    def executemany(self, sql: str, rows: Iterable[Sequence]) -> int:
+        """ bind every row to the same statement, left uncommitted so that callers
+            decide the transaction boundary
+        """
+        self.statement_cache.touch(sql)
+        start = time.perf_counter()
         cur = self.conn.cursor()
-        cur.execute(sql)
-        return cur.fetchall()
+        cur.executemany(sql, rows)
+        self._record(sql, None, time.perf_counter() - start, cur.rowcount)
+        return cur.rowcount
+
+    @assert_connected
+    def fetch(self, sql: str, params: Sequence = (), record_type: type = None) -> list:
+        """ rows as tuples, or as record_type instances built by RowMapper
+        """
+        self.statement_cache.touch(sql)
+        start = time.perf_counter()
+        cur = self.conn.cursor()
+        cur.execute(sql, params)
+        if record_type is not None:
+            cur.row_factory = RowMapper.for_cursor(record_type, cur)
+        rows = cur.fetchall()
+        self._record(sql, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    @assert_connected
+    def iter_fetch(
+        self,
+        sql: str,
+        params: Sequence = (),
+        chunk_size: int = 1000,
+        record_type: type = None,
+    ) -> Iterator:
+        """ lazily yield rows, holding at most chunk_size of them in memory
+            only time spent inside sqlite is recorded, not time spent by the consumer
+        """
+        self.statement_cache.touch(sql)
+        start = time.perf_counter()
+        cur = self.conn.cursor()
+        n_rows, seconds = 0, 0.0
+        try:
+            cur.execute(sql, params)
+            if record_type is not None:
+                cur.row_factory = RowMapper.for_cursor(record_type, cur)
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                seconds += time.perf_counter() - start
+                if not chunk:
+                    break
+                n_rows += len(chunk)
+                yield from chunk
+                start = time.perf_counter()
+        finally:
+            cur.close()
+        self._record(sql, params, seconds, n_rows)
+
+    @contextmanager
+    def cursor(self, sql: str, params: Sequence = ()):
+        """ executed cursor for callers that consume results themselves
+            the recorded time spans from execute until the cursor is closed
+        """
+        assert self.connected, f"{self.__class__.__name__} is not connected"
+        self.statement_cache.touch(sql)
+        start = time.perf_counter()
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, params)
+            yield cur
+        finally:
+            cur.close()
+        self._record(sql, params, time.perf_counter() - start, None)
+
+    @assert_connected
+    def explain(self, sql: str, params: Sequence = ()) -> List[str]:
+        rows = self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row[-1] for row in rows]
+
+    @assert_connected
+    def tables_read(self, sql: str, params: Sequence = ()) -> Optional[List[str]]:
+        """ tables a query reads, views resolved to their base tables, or None
+            when it is not a plain select on the main and temp databases
+            Names come from the b-trees the compiled program opens, the authorizer
+            misses some (e.g. the right side of JOIN ... USING inside a view).
+        """
+        plain = True
+
+        def authorize(action, *args):
+            nonlocal plain
+            plain = plain and action in self._PLAIN_READ
+            return sqlite3.SQLITE_OK
+
+        self.conn.set_authorizer(authorize)
+        try:
+            program = self.conn.execute(f"EXPLAIN {sql}", params).fetchall()
+        finally:
+            self.conn.set_authorizer(None)
+        if not plain:
+            return None
+        roots = {}
+        for db, schema in enumerate(("sqlite_master", "sqlite_temp_master")):
+            roots[db, 1] = schema
+            for page, table in self.conn.execute(
+                f"SELECT rootpage, tbl_name FROM {schema} WHERE rootpage > 0"
+            ):
+                roots[db, page] = table.lower()
+        tables = set()
+        for _, opcode, _, page, db, *_ in program:
+            if opcode in ("OpenWrite", "VOpen"):
+                return None
+            if opcode == "OpenRead":
+                if (db, page) not in roots:
+                    return None  # attached database
+                tables.add(roots[db, page])
+        return sorted(tables)
+
+    @assert_connected
+    def commit(self):
+        """ no-op inside transaction(), the outermost scope decides
+        """
+        if not self._tx_depth:
+            self.conn.commit()
+
+    @assert_connected
+    def rollback(self):
+        """ no-op inside transaction(), the scope rolls back when the error reaches it
+        """
+        if not self._tx_depth:
+            self.conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """ atomic unit of work, statements inside are not committed one by one
+            the outermost scope runs BEGIN ... COMMIT, nested scopes are savepoints
+            so an inner failure can be rolled back without losing outer work
+        """
+        assert self.connected, f"{self.__class__.__name__} is not connected"
+        savepoint = f"sp_{self._tx_depth}"
+        # a direct executemany may have left an implicit transaction open, the
+        # outermost scope then joins it with a savepoint and commits it on exit
+        use_savepoint = bool(self._tx_depth) or self.conn.in_transaction
+        self.conn.execute(f"SAVEPOINT {savepoint}" if use_savepoint else "BEGIN")
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            if use_savepoint:
+                self.conn.execute(f"ROLLBACK TO {savepoint}")
+                self.conn.execute(f"RELEASE {savepoint}")
+            else:
+                self.conn.rollback()
+            raise
+        self._tx_depth -= 1
+        if use_savepoint:
+            self.conn.execute(f"RELEASE {savepoint}")
+        if not self._tx_depth:
+            self.conn.commit()
 
 
 class DBClient(abc.ABC):
@@ -104,44 +590,1321 @@ class DBClient(abc.ABC):
         self.db_conn.disconnect()
         logger.info(f"{self.__class__.__name__} disconnected")
 
+    @contextmanager
+    def transaction(self):
+        """ run several client calls as one atomic unit, scopes can be nested
+        """
+        with self.db_conn.transaction():
+            yield self
+
     @abc.abstractmethod
-    def insert(self, table: str, rows: list):
+    def insert(self, table: str, rows: Iterable[Sequence]):
         pass
 
 
+@dataclass
+class BulkInsertStats:
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            "numpy is required for columnar results, install it with `inv bootstrap`"
+        ) from e
+    return numpy
+
+
+def quote_identifier(name: str) -> str:
+    """ quote table/column names, values should always be bound as parameters
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    """ only for statements that cannot take bind parameters, such as triggers
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def batched(rows: Iterable, batch_size: int) -> Iterator[List]:
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+Where = Union[str, Dict[str, Any], None]
+
+
+class Query(NamedTuple):
+    sql: str
+    params: tuple
+
+
+class QueryBuilder:
+    """ Emits parameterized SQL whose text depends only on the shape of the query
+        Identifiers are quoted and values are always bound, so repeated queries
+        reuse the same statement text and hit the sqlite statement cache.
+        where is either a SQL fragment using ? placeholders bound from params or
+        a dict of column equality filters (None matches NULL).
+    """
+
+    @staticmethod
+    def _where(where: Where, params: Sequence) -> Query:
+        if not where:
+            return Query("", tuple(params))
+        if isinstance(where, str):
+            return Query(f" WHERE {where}", tuple(params))
+        clauses, values = [], []
+        for col in sorted(where):  # sorted so filter order does not change the text
+            if where[col] is None:
+                clauses.append(f"{quote_identifier(col)} IS NULL")
+            else:
+                clauses.append(f"{quote_identifier(col)} = ?")
+                values.append(where[col])
+        return Query(" WHERE " + " AND ".join(clauses), tuple(values) + tuple(params))
+
+    @classmethod
+    def select(
+        cls,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        where: Where = None,
+        params: Sequence = (),
+        order_by: Union[str, Sequence[str], None] = None,
+        limit: Optional[int] = None,
+    ) -> Query:
+        """ order_by takes column names, prefix one with '-' to sort descending
+        """
+        projection = ", ".join(map(quote_identifier, columns)) if columns else "*"
+        where_sql, params = cls._where(where, params)
+        sql = f"SELECT {projection} FROM {quote_identifier(table)}{where_sql}"
+        if order_by:
+            order_by = [order_by] if isinstance(order_by, str) else order_by
+            sql += " ORDER BY " + ", ".join(
+                f"{quote_identifier(col[1:])} DESC"
+                if col.startswith("-")
+                else quote_identifier(col)
+                for col in order_by
+            )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return Query(sql, params)
+
+    @staticmethod
+    def insert(table: str, row: Union[Dict[str, Any], Sequence]) -> Query:
+        """ a dict row names its columns, a sequence fills every column in order
+            the returned sql can be reused with executemany for rows of same shape,
+            dict rows bound as tuples in sorted column order (see bulk_insert)
+        """
+        if isinstance(row, dict):
+            columns = sorted(row)
+            names = " (" + ", ".join(map(quote_identifier, columns)) + ")"
+            params = tuple(row[col] for col in columns)
+        else:
+            names, params = "", tuple(row)
+        placeholders = ", ".join("?" * len(params))
+        return Query(
+            f"INSERT INTO {quote_identifier(table)}{names} VALUES ({placeholders})",
+            params,
+        )
+
+    @classmethod
+    def update(
+        cls, table: str, values: Dict[str, Any], where: Where, params: Sequence = ()
+    ) -> Query:
+        assert values, "update requires at least one column to set"
+        columns = sorted(values)
+        assignments = ", ".join(f"{quote_identifier(col)} = ?" for col in columns)
+        where_sql, where_params = cls._where(where, params)
+        return Query(
+            f"UPDATE {quote_identifier(table)} SET {assignments}{where_sql}",
+            tuple(values[col] for col in columns) + where_params,
+        )
+
+    @classmethod
+    def delete(cls, table: str, where: Where, params: Sequence = ()) -> Query:
+        where_sql, params = cls._where(where, params)
+        return Query(f"DELETE FROM {quote_identifier(table)}{where_sql}", params)
+
+
+class ResultCache:
+    """ Opt-in read-through cache of query results for SqliteClient
+        Entries are keyed by whitespace-normalized sql plus params and evicted LRU
+        beyond max_entries. Each entry records the version of every table it
+        reads, as sqlite resolves them (views to their base tables); writes made
+        through a client sharing this cache bump those versions so stale entries
+        are dropped on lookup. Queries sqlite cannot attribute to tables (pragmas,
+        virtual or attached tables) are never cached. Writes from other processes
+        are not seen, only share a cache between clients of the same database file.
+    """
+
+    DEFAULT_MAX_ENTRIES = 256
+    DEFAULT_MAX_ROWS = 10_000  # larger results are streamed but never cached
+
+    _IDENT = r'("(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+)'
+    _WRITE_RE = re.compile(
+        r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO"
+        r"|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM"
+        r"|(?:DROP|ALTER|CREATE)\s+TABLE(?:\s+IF(?:\s+NOT)?\s+EXISTS)?)"
+        rf"\s+{_IDENT}",
+        re.IGNORECASE,
+    )
+    _DDL_RE = re.compile(r"^\s*(?:CREATE|DROP|ALTER)\b", re.IGNORECASE)
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, max_rows: int = DEFAULT_MAX_ROWS,
+    ):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[tuple, Tuple[Dict[str, int], list]]" = (
+            OrderedDict()
+        )
+        self._versions: Dict[str, int] = {}
+        self._generation = 0  # bumped when a write cannot be attributed to a table
+        self._reads: Dict[str, Optional[List[str]]] = {}  # sql -> tables it reads
+        self._schema = 0  # bumped when schema changes make _reads stale
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _table_name(ident: str) -> str:
+        if ident[0] in '"`[':
+            ident = ident[1:-1].replace('""', '"')
+        return ident.lower()
+
+    @classmethod
+    def table_written(cls, sql: str) -> Optional[str]:
+        match = cls._WRITE_RE.match(sql)
+        return cls._table_name(match.group(1)) if match else None
+
+    @staticmethod
+    def _key(sql: str, params: Sequence) -> Optional[tuple]:
+        key = (" ".join(sql.split()), tuple(params))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _snapshot(self, tables: List[str]) -> Dict[str, int]:
+        snapshot = {t: self._versions.get(t, 0) for t in tables}
+        snapshot[""] = self._generation
+        return snapshot
+
+    def get(self, sql: str, params: Sequence = ()) -> Optional[list]:
+        key = self._key(sql, params)
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is not None:
+                versions, rows = entry
+                if versions == self._snapshot([t for t in versions if t]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return rows
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def versions(
+        self, sql: str, resolve: Callable[[], Optional[List[str]]]
+    ) -> Optional[Dict[str, int]]:
+        """ versions of the tables sql reads, take them before running the query
+            and hand them to put; resolve lists those tables (see
+            DBConnection.tables_read) the first time sql is seen. None when sql
+            cannot be attributed, its rows are then not cached
+        """
+        sql = " ".join(sql.split())
+        with self._lock:
+            schema, known = self._schema, sql in self._reads
+            tables = self._reads.get(sql)
+        if not known:
+            tables = resolve()
+        with self._lock:
+            if not known and schema == self._schema:
+                self._reads[sql] = tables
+            return None if tables is None else self._snapshot(tables)
+
+    def put(
+        self,
+        sql: str,
+        params: Sequence,
+        rows: list,
+        versions: Optional[Dict[str, int]],
+    ):
+        """ versions are those from before the query ran, if a write landed while
+            it was in flight the rows may predate it and are not cached
+        """
+        key = self._key(sql, params)
+        if key is None or versions is None or len(rows) > self.max_rows:
+            return
+        with self._lock:
+            if versions != self._snapshot([t for t in versions if t]):
+                self.invalidations += 1
+                return
+            self._entries[key] = (versions, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None):
+        """ bump versions of tables, or of every entry when tables is None
+        """
+        with self._lock:
+            if tables is None:
+                self._generation += 1
+                self._reads.clear()
+                self._schema += 1
+                return
+            for table in tables:
+                table = table.lower()
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def invalidate_sql(self, sql: str):
+        """ invalidate whatever a write statement touches, reads are left alone
+        """
+        if sql.lstrip()[:6].upper() in ("SELECT", "PRAGMA"):
+            return
+        table = self.table_written(sql)
+        if self._DDL_RE.match(sql):
+            with self._lock:  # e.g. a renamed table changes what views read
+                self._reads.clear()
+                self._schema += 1
+        self.invalidate(None if table is None else [table])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class Change(NamedTuple):
+    seq: int
+    table: str
+    op: str  # INSERT, UPDATE or DELETE
+    row_id: int
+    data: Optional[Dict[str, Any]]  # new row for INSERT/UPDATE, old row for DELETE
+    at: float  # unix time
+
+
 class SqliteClient(DBClient):
     """
     Custom DB client with limited type conversion
     Existing packages such as sqlachemy provides more functionality
     """
 
+    DEFAULT_BATCH_SIZE = 10_000
+    DEFAULT_CHUNK_SIZE = 1000
+
+    def __init__(self, db_conn: DBConnection, cache: Optional[ResultCache] = None):
+        super().__init__(db_conn)
+        self.cache = cache
+
+    @classmethod
+    def from_db_info(cls, db_info: SqliteInfo, cache: Optional[ResultCache] = None):
+        return cls(SqliteConnection(db_info), cache)
+
     @classmethod
-    def from_db_info(cls, db_info: SqliteInfo):
-        return cls(SqliteConnection(db_info))
+    def from_wal_db_info(
+        cls, db_info: SqliteInfo, cache: Optional[ResultCache] = None, **kwargs
+    ):
+        """ client safe to share between threads, kwargs go to WalSqliteConnection
+        """
+        return cls(WalSqliteConnection(db_info, **kwargs), cache)
+
+    @contextmanager
+    def transaction(self):
+        try:
+            with super().transaction():
+                yield self
+        except BaseException:
+            if self.cache is not None:
+                self.cache.invalidate()  # results read inside may have been undone
+            raise
+
+    def _invalidate(self, table: str):
+        if self.cache is not None:
+            self.cache.invalidate([table])
+
+    def execute(self, sql: str, params: Sequence = ()) -> int:
+        try:
+            return self.db_conn.execute(sql, params)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate_sql(sql)
+
+    def fetch(self, sql: str, params: Sequence = ()) -> list:
+        """ raw query, served from the result cache when enabled
+        """
+        if self.cache is None or self.db_conn.in_transaction:
+            # uncommitted rows must not reach the clients sharing the cache
+            return self.db_conn.fetch(sql, params)
+        rows = self.cache.get(sql, params)
+        if rows is None:
+            versions = self.cache.versions(
+                sql, lambda: self.db_conn.tables_read(sql, params)
+            )
+            rows = self.db_conn.fetch(sql, params)
+            self.cache.put(sql, params, rows, versions)
+        return list(rows)
+
+    def table_columns(self, table: str) -> List[str]:
+        rows = self.db_conn.fetch(f"PRAGMA table_info({quote_identifier(table)})")
+        return [row[1] for row in rows]
+
+    def _record_factory(
+        self, table: str, columns: Optional[Sequence[str]], record_type: type
+    ) -> Callable:
+        """ factory for rows served by the result cache, which stores plain tuples
+            so cached records are never shared between callers
+        """
+        return RowMapper.compile(record_type, columns or self.table_columns(table))
+
+    def _iter_fetch(self, sql: str, params: Sequence, chunk_size: int):
+        """ stream rows, caching the result once fully read if it is small enough
+        """
+        if self.db_conn.in_transaction:
+            yield from self.db_conn.iter_fetch(sql, params, chunk_size)
+            return
+        rows = self.cache.get(sql, params)
+        if rows is not None:
+            yield from rows
+            return
+        versions = self.cache.versions(
+            sql, lambda: self.db_conn.tables_read(sql, params)
+        )
+        seen = [] if versions is not None else None
+        for row in self.db_conn.iter_fetch(sql, params, chunk_size):
+            if seen is not None:
+                seen.append(row)
+                if len(seen) > self.cache.max_rows:
+                    seen = None
+            yield row
+        if seen is not None:
+            self.cache.put(sql, params, seen, versions)
 
     @staticmethod
-    def _make_row(row: list):
-        items = []
-        for val in row:
-            if isinstance(val, Number):
-                items.append(f"{val}")
-            elif isinstance(val, str):
-                items.append(f"'{val}'")
-            elif isinstance(val, Union(dt.datetime, dt.date)):
-                items.append(f"'{val}'")
+    def _insert_batches(
+        table: str, rows: Iterable[Sequence], batch_size: int
+    ) -> Iterator[Query]:
+        sql, columns = None, None
+        for batch in batched(rows, batch_size):
+            if sql is None:
+                sql = QueryBuilder.insert(table, batch[0]).sql
+                if isinstance(batch[0], dict):
+                    columns = sorted(batch[0])
+            if columns is not None:
+                # positional placeholders, in the order QueryBuilder listed
+                batch = [tuple(row[col] for col in columns) for row in batch]
+            yield Query(sql, batch)
+
+    def bulk_insert(
+        self,
+        table: str,
+        rows: Iterable[Sequence],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        commit_every: Optional[int] = None,
+    ) -> BulkInsertStats:
+        """ stream rows (any iterable or generator) into table with bound parameters
+            rows are sent to executemany in batches of batch_size, the load runs as
+            a single transaction unless commit_every (in batches) is given, in which
+            case partial progress is committed along the way. On a
+            WalSqliteConnection each transaction is one write, its rows are held in
+            memory until it commits.
+        """
+        assert batch_size > 0, "batch_size must be positive"
+        start = time.perf_counter()
+        n_rows = 0
+        queries = self._insert_batches(table, rows, batch_size)
+        try:
+            while True:
+                n_batches = 0
+                with self.db_conn.transaction():
+                    for sql, batch in islice(queries, commit_every):
+                        n_rows += self.db_conn.executemany(sql, batch)
+                        n_batches += 1
+                if not commit_every or n_batches < commit_every:
+                    break
+        finally:
+            self._invalidate(table)
+        stats = BulkInsertStats(n_rows, time.perf_counter() - start)
+        logger.info(
+            f"{stats.rows} records added to table {table} in {stats.seconds:.3f}s "
+            f"({stats.rows_per_sec:,.0f} rows/s)"
+        )
+        return stats
+
+    def insert(self, table: str, rows: Iterable[Sequence]) -> BulkInsertStats:
+        return self.bulk_insert(table, rows)
+
+    def iter_rows(
+        self,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        where: Where = None,
+        params: Sequence = (),
+        order_by: Union[str, Sequence[str], None] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        record_type: type = None,
+    ) -> Iterator:
+        """ stream rows from table, reading chunk_size rows per fetch
+            rows are tuples unless a record_type (dataclass, NamedTuple or __slots__
+            class) is given, see RowMapper
+            e.g. iter_rows("library", ["name"], where="rating >= ?", params=[8])
+        """
+        sql, params = QueryBuilder.select(
+            table, columns, where, params, order_by, limit
+        )
+        if self.cache is None:
+            return self.db_conn.iter_fetch(sql, params, chunk_size, record_type)
+        rows = self._iter_fetch(sql, params, chunk_size)
+        if record_type is None:
+            return rows
+        factory = self._record_factory(table, columns, record_type)
+        return (factory(None, row) for row in rows)
+
+    def get(
+        self,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        where: Where = None,
+        params: Sequence = (),
+        order_by: Union[str, Sequence[str], None] = None,
+        limit: Optional[int] = None,
+        record_type: type = None,
+    ) -> list:
+        sql, params = QueryBuilder.select(
+            table, columns, where, params, order_by, limit
+        )
+        if record_type is None:
+            return self.fetch(sql, params)
+        if self.cache is None:
+            return self.db_conn.fetch(sql, params, record_type)
+        factory = self._record_factory(table, columns, record_type)
+        return [factory(None, row) for row in self.fetch(sql, params)]
+
+    def update(
+        self, table: str, values: Dict[str, Any], where: Where, params: Sequence = ()
+    ):
+        query = QueryBuilder.update(table, values, where, params)
+        self.execute(*query)
+        logger.info(f"updated {table} set {list(values)} where {where}")
+
+    def delete(self, table: str, where: Where, params: Sequence = ()):
+        query = QueryBuilder.delete(table, where, params)
+        self.execute(*query)
+        logger.info(f"deleted from {table} where {where}")
+
+    # ~~~~~~~~~~~~~~~~ change data capture ~~~~~~~~~~~~~~~~~~
+    CHANGE_LOG = "_change_log"
+    CHANGE_CONSUMERS = "_change_consumers"
+    BLOB_KEY = "$blob"  # json cannot hold blobs, they are logged as {"$blob": hex}
+
+    @classmethod
+    def _decode_change(cls, value: Any) -> Any:
+        if isinstance(value, dict) and list(value) == [cls.BLOB_KEY]:
+            return bytes.fromhex(value[cls.BLOB_KEY])
+        return value
+
+    def _ensure_change_tables(self):
+        self.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.CHANGE_LOG} (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tbl TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    row_id INTEGER,
+                    data TEXT,
+                    at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+                )"""
+        )
+        self.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.CHANGE_CONSUMERS} (
+                    name TEXT PRIMARY KEY,
+                    acked INTEGER NOT NULL
+                )"""
+        )
+
+    def capture_changes(self, table: str):
+        """ install triggers logging every insert, update and delete on table
+            rows are snapshotted as json, so columns added later need a re-install;
+            blob values are hex encoded in the log and decoded by changes_since
+        """
+        self._ensure_change_tables()
+        columns = self.table_columns(table)
+        assert columns, f"table {table} does not exist"
+        for op, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            # triggers cannot take bind parameters, names are quoted as literals
+            values = (f"{ref}.{quote_identifier(col)}" for col in columns)
+            data = ", ".join(
+                f"{quote_literal(col)}, CASE WHEN typeof({value}) = 'blob' "
+                f"THEN json_object('{self.BLOB_KEY}', hex({value})) ELSE {value} END"
+                for col, value in zip(columns, values)
+            )
+            trigger = quote_identifier(f"_cdc_{table}_{op.lower()}")
+            self.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            self.execute(
+                f"""CREATE TRIGGER {trigger} AFTER {op} ON {quote_identifier(table)}
+                    BEGIN
+                        INSERT INTO {self.CHANGE_LOG} (tbl, op, row_id, data)
+                        VALUES ({quote_literal(table)}, '{op}', {ref}.rowid,
+                                json_object({data}));
+                    END"""
+            )
+        logger.info(f"capturing changes on {table}")
+
+    def stop_capture(self, table: str):
+        for op in ("insert", "update", "delete"):
+            trigger = quote_identifier(f"_cdc_{table}_{op}")
+            self.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        logger.info(f"stopped capturing changes on {table}")
+
+    def changes_since(
+        self,
+        cursor: int = 0,
+        tables: Optional[Sequence[str]] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> Iterator[Change]:
+        """ changes logged after cursor (a Change.seq) in commit order
+        """
+        where, params = "seq > ?", [cursor]
+        if tables:
+            where += f" AND tbl IN ({', '.join('?' * len(tables))})"
+            params += list(tables)
+        rows = self.db_conn.iter_fetch(
+            *QueryBuilder.select(self.CHANGE_LOG, None, where, params, "seq"),
+            chunk_size,
+        )
+        for seq, table, op, row_id, data, at in rows:
+            if data:
+                data = {
+                    col: self._decode_change(value)
+                    for col, value in json.loads(data).items()
+                }
+            yield Change(seq, table, op, row_id, data, at)
+
+    def register_consumer(self, name: str, from_start: bool = False) -> int:
+        """ track a consumer so log entries are kept until it acknowledges them
+            new consumers start after the latest change unless from_start is set,
+            returns the consumer's cursor
+        """
+        self._ensure_change_tables()
+        acked = self.db_conn.fetch(
+            f"SELECT acked FROM {self.CHANGE_CONSUMERS} WHERE name = ?", [name]
+        )
+        if acked:
+            return acked[0][0]
+        cursor = 0
+        if not from_start:
+            latest = self.db_conn.fetch(f"SELECT MAX(seq) FROM {self.CHANGE_LOG}")
+            cursor = latest[0][0] or 0
+        self.execute(
+            f"INSERT INTO {self.CHANGE_CONSUMERS} (name, acked) VALUES (?, ?)",
+            [name, cursor],
+        )
+        return cursor
+
+    def unregister_consumer(self, name: str):
+        self.execute(f"DELETE FROM {self.CHANGE_CONSUMERS} WHERE name = ?", [name])
+        self.compact_changes()
+
+    def consume_changes(
+        self, name: str, tables: Optional[Sequence[str]] = None
+    ) -> Iterator[Change]:
+        """ changes the consumer has not acknowledged yet
+        """
+        return self.changes_since(self.register_consumer(name), tables)
+
+    def ack_changes(self, name: str, cursor: int):
+        """ mark everything up to cursor as processed by consumer name
+            entries acknowledged by every consumer are compacted away
+        """
+        self.execute(
+            f"UPDATE {self.CHANGE_CONSUMERS} SET acked = MAX(acked, ?) WHERE name = ?",
+            [cursor, name],
+        )
+        self.compact_changes()
+
+    def compact_changes(self) -> int:
+        """ drop log entries every registered consumer has acknowledged
+        """
+        acked = f"seq <= (SELECT MIN(acked) FROM {self.CHANGE_CONSUMERS})"
+        n_acked = self.db_conn.fetch(
+            f"SELECT COUNT(*) FROM {self.CHANGE_LOG} WHERE {acked}"
+        )[0][0]
+        if n_acked:
+            self.execute(f"DELETE FROM {self.CHANGE_LOG} WHERE {acked}")
+            logger.info(f"compacted {n_acked} acknowledged changes")
+        return n_acked
+
+    @staticmethod
+    def _infer_dtype(np, values: list):
+        types = set(map(type, values))
+        if types <= {int}:
+            return np.dtype(np.int64)
+        if types <= {int, float, type(None)}:
+            return np.dtype(np.float64)  # NULL becomes nan
+        return np.dtype(object)
+
+    def get_columns(
+        self,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        where: Where = None,
+        params: Sequence = (),
+        order_by: Union[str, Sequence[str], None] = None,
+        limit: Optional[int] = None,
+        dtypes: Optional[Dict[str, Any]] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> Dict[str, Any]:
+        """ query results as one numpy array per column, filled chunk by chunk
+            dtypes are inferred per column (int64, float64 with NULL as nan, object
+            otherwise) and widened if a later chunk needs it, unless given in dtypes
+        """
+        np = _import_numpy()
+        dtypes = {k: np.dtype(v) for k, v in (dtypes or {}).items()}
+        sql, params = QueryBuilder.select(
+            table, columns, where, params, order_by, limit
+        )
+        with self.db_conn.cursor(sql, params) as cur:
+            names = [d[0] for d in cur.description]
+            buffers = [None] * len(names)
+            n_rows = 0
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                end = n_rows + len(chunk)
+                for i, name in enumerate(names):
+                    values = list(map(itemgetter(i), chunk))
+                    dtype = dtypes.get(name) or self._infer_dtype(np, values)
+                    buf = buffers[i]
+                    if buf is None:
+                        buf = np.empty(max(end, chunk_size), dtype=dtype)
+                    elif np.result_type(buf.dtype, dtype) != buf.dtype:
+                        buf = buf.astype(np.result_type(buf.dtype, dtype))
+                    if end > len(buf):
+                        grown = np.empty(max(end, 2 * len(buf)), dtype=buf.dtype)
+                        grown[:n_rows] = buf[:n_rows]
+                        buf = grown
+                    buf[n_rows:end] = np.array(values, dtype=buf.dtype)
+                    buffers[i] = buf
+                n_rows = end
+        result = {}
+        for name, buf in zip(names, buffers):
+            if buf is None:
+                buf = np.empty(0, dtype=dtypes.get(name, np.float64))
+            buf.resize(n_rows, refcheck=False)  # release spare capacity in place
+            result[name] = buf
+        logger.info(f"loaded {n_rows} rows x {len(names)} columns from {table}")
+        return result
+
+    def get_records(self, table: str, **kwargs) -> Any:
+        """ same query options as get_columns, packed into a numpy structured array
+        """
+        np = _import_numpy()
+        columns = self.get_columns(table, **kwargs)
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        records = np.empty(n_rows, dtype=[(k, v.dtype) for k, v in columns.items()])
+        for name in list(columns):
+            records[name] = columns.pop(name)  # free each column once copied
+        return records
+
+
+class SqliteConnectionPool:
+    """ Bounded pool of warm sqlite connections for a single DbInfo.url
+        Connections are opened lazily up to max_size, reused LIFO so the hottest
+        ones stay warm, health checked on checkout and evicted after max_idle
+        seconds without use. Use for_db_info to share one pool per url.
+    """
+
+    DEFAULT_MAX_SIZE = 8
+    DEFAULT_MAX_IDLE = 300  # seconds
+
+    _pools: Dict[str, "SqliteConnectionPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(
+        self,
+        db_info: SqliteInfo,
+        max_size: int = DEFAULT_MAX_SIZE,
+        max_idle: float = DEFAULT_MAX_IDLE,
+        timeout: Optional[float] = None,
+        result_cache: Optional[ResultCache] = None,
+        instruments: Sequence[Instrument] = (),
+        read_only: bool = False,
+    ):
+        assert max_size > 0, "max_size must be positive"
+        self.db_info = db_info
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.result_cache = result_cache  # shared by every client the pool hands out
+        self.instruments = list(instruments)  # shared by every pooled connection
+        self.read_only = read_only
+        self._idle: List[Tuple[float, SqliteConnection]] = []  # (last used, conn)
+        self._n_open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._g_key = f"sqlite_pool_conn:{db_info.url}"
+
+    @classmethod
+    def for_db_info(cls, db_info: SqliteInfo, **kwargs) -> "SqliteConnectionPool":
+        with cls._pools_lock:
+            pool = cls._pools.get(db_info.url)
+            if pool is None or pool._closed:
+                pool = cls._pools[db_info.url] = cls(db_info, **kwargs)
+            return pool
+
+    @property
+    def size(self) -> int:
+        return self._n_open
+
+    def _new_connection(self) -> SqliteConnection:
+        conn = SqliteConnection(
+            self.db_info, check_same_thread=False, read_only=self.read_only
+        )
+        conn.instruments = self.instruments
+        conn.connect()
+        logger.debug(f"pool opened connection to {self.db_info.url}")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: SqliteConnection) -> bool:
+        try:
+            conn.conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return conn.connected and not conn.conn.in_transaction
+
+    def _pop_expired(self) -> List[SqliteConnection]:
+        """ idle list is ordered by last use, so expired connections sit at the front
+            must be called with the condition held
+        """
+        cutoff = time.monotonic() - self.max_idle
+        n_expired = 0
+        while n_expired < len(self._idle) and self._idle[n_expired][0] < cutoff:
+            n_expired += 1
+        expired = [conn for _, conn in self._idle[:n_expired]]
+        del self._idle[:n_expired]
+        self._n_open -= n_expired
+        return expired
+
+    def evict_idle(self) -> int:
+        with self._cond:
+            expired = self._pop_expired()
+            self._cond.notify(len(expired))
+        for conn in expired:
+            conn.disconnect()
+        return len(expired)
+
+    def checkout(self, timeout: Optional[float] = None) -> SqliteConnection:
+        """ blocks up to timeout seconds when all max_size connections are in use
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            expired = []
+            with self._cond:
+                while True:
+                    assert not self._closed, "connection pool is closed"
+                    expired += self._pop_expired()
+                    if self._idle:
+                        _, conn = self._idle.pop()
+                        break
+                    if self._n_open < self.max_size:
+                        self._n_open += 1
+                        conn = None
+                        break
+                    remaining = deadline and deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(
+                            f"no connection to {self.db_info.url} available "
+                            f"within {timeout}s"
+                        )
+                    self._cond.wait(remaining)
+            for stale in expired:
+                stale.disconnect()
+            if conn is None:
+                try:
+                    return self._new_connection()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._is_healthy(conn):
+                return conn
+            logger.warning(f"discarding unhealthy connection to {self.db_info.url}")
+            conn.disconnect()
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._n_open -= 1
+            self._cond.notify()
+
+    def checkin(self, conn: SqliteConnection):
+        if conn.connected and conn.conn.in_transaction:
+            conn.rollback()  # never hand out a connection with pending work
+        with self._cond:
+            if not self._closed and conn.connected:
+                self._idle.append((time.monotonic(), conn))
+                self._cond.notify()
+                return
+            self._n_open -= 1
+            self._cond.notify()
+        conn.disconnect()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    @contextmanager
+    def client(self, timeout: Optional[float] = None):
+        with self.connection(timeout) as conn:
+            yield SqliteClient(conn, self.result_cache)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for _, conn in self._idle]
+            self._n_open -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for conn in idle:
+            conn.disconnect()
+
+    # ~~~~~~~~~~~~~~~~ flask integration ~~~~~~~~~~~~~~~~~~
+    def init_app(self, app):
+        """ return the connection checked out by app_client when the app context ends
+        """
+        app.teardown_appcontext(self._teardown_app_context)
+
+    def app_client(self) -> SqliteClient:
+        """ client bound to a pooled connection for the current flask app context
+        """
+        from flask import g  # flask is only needed by web apps using the pool
+
+        conn = g.get(self._g_key)
+        if conn is None:
+            conn = self.checkout()
+            setattr(g, self._g_key, conn)
+        return SqliteClient(conn, self.result_cache)
+
+    def _teardown_app_context(self, exc):
+        from flask import g
+
+        conn = g.pop(self._g_key, None)
+        if conn is not None:
+            self.checkin(conn)
+
+
+class WalSqliteConnection(DBConnection):
+    """ Single-writer / multi-reader sqlite connection for multithreaded servers
+        The database is switched to WAL so readers never block the writer. All
+        writes are queued to one dedicated writer thread that owns the only
+        read-write connection, reads are served from a pool of read-only
+        connections. The object itself can be shared by any number of threads.
+
+        Writes are group committed: the writer drains whatever is queued (waiting
+        up to group_window seconds for more) and runs up to max_group of them in
+        one transaction, each in its own savepoint, so a failing write is rolled
+        back alone while the rest share a single commit. Every execute call is
+        one such write, use write() or transaction() to run several statements
+        as one unit.
+    """
+
+    DEFAULT_READERS = 4
+    DEFAULT_QUEUE_SIZE = 1000
+    DEFAULT_GROUP_WINDOW = 0.0  # seconds, only group writes that are already queued
+    DEFAULT_MAX_GROUP = 100
+
+    def __init__(
+        self,
+        db_info: SqliteInfo,
+        readers: int = DEFAULT_READERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        group_window: float = DEFAULT_GROUP_WINDOW,
+        max_group: int = DEFAULT_MAX_GROUP,
+    ):
+        super().__init__(db_info)
+        self.readers = readers
+        self.group_window = group_window
+        self.max_group = max_group
+        self.writes = 0
+        self.commits = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(queue_size)
+        self._writer_thread: Optional[threading.Thread] = None
+        self._reader_pool: Optional[SqliteConnectionPool] = None
+        self._scopes = threading.local()  # statements of each thread's transaction
+
+    def connect(self):
+        if self.connected:
+            return
+        ready: Future = Future()
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop,
+            args=(ready,),
+            name=f"sqlite-writer:{self.db_info.url}",
+            daemon=True,
+        )
+        self._writer_thread.start()
+        ready.result()  # WAL must be on before readers open the file
+        self._reader_pool = SqliteConnectionPool(
+            self.db_info, max_size=self.readers, read_only=True
+        )
+        self._reader_pool.instruments = self.instruments
+        self.connected = True
+
+    def disconnect(self):
+        if not self.connected:
+            return
+        self._queue.put(None)
+        self._writer_thread.join()
+        self._reader_pool.close()
+        self.connected = False
+
+    def _writer_loop(self, ready: Future):
+        writer = SqliteConnection(self.db_info)
+        try:
+            writer.connect()
+            mode = writer.fetch("PRAGMA journal_mode=WAL")[0][0]
+            writer.execute("PRAGMA synchronous=NORMAL")
+            logger.info(f"sqlite writer for {self.db_info.url} in {mode} mode")
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        writer.instruments = self.instruments
+        ready.set_result(None)
+        stopping = False
+        while not stopping:
+            group = [self._queue.get()]
+            deadline = time.monotonic() + self.group_window
+            while group[-1] is not None and len(group) < self.max_group:
+                try:
+                    timeout = max(0.0, deadline - time.monotonic())
+                    group.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if group[-1] is None:
+                stopping = True
+                group.pop()
+            if group:
+                self._commit_group(writer, group)
+        writer.disconnect()
+
+    def _commit_group(self, writer: SqliteConnection, group: List[tuple]):
+        done = []
+        try:
+            with writer.transaction():
+                for fn, future in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with writer.transaction():  # savepoint per write
+                            done.append((future, fn(writer)))
+                    except BaseException as e:
+                        future.set_exception(e)
+        except BaseException as e:  # the commit itself failed, nothing was kept
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        self.writes += len(group)
+        self.commits += 1
+        for future, result in done:
+            future.set_result(result)
+
+    @assert_connected
+    def submit(self, fn: Callable[[SqliteConnection], Any]) -> Future:
+        """ queue fn(writer_connection) to run atomically on the writer thread
+            the future resolves once the group it ran in has been committed
+        """
+        future: Future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def write(self, fn: Callable[[SqliteConnection], Any]) -> Any:
+        return self.submit(fn).result()
+
+    def _pending(self) -> Optional[list]:
+        return getattr(self._scopes, "statements", None)
+
+    def execute(self, sql: str, params: Sequence = ()) -> Optional[int]:
+        """ lastrowid, or None inside transaction() where the statement is only
+            queued until the scope ends
+        """
+        pending = self._pending()
+        if pending is not None:
+            pending.append((False, sql, params))
+            return None
+        return self.write(lambda writer: writer.execute(sql, params))
+
+    def executemany(self, sql: str, rows: Iterable[Sequence]) -> Optional[int]:
+        rows = list(rows)  # the writer thread must not consume a caller's generator
+        pending = self._pending()
+        if pending is not None:
+            pending.append((True, sql, rows))
+            return len(rows)
+        return self.write(lambda writer: writer.executemany(sql, rows))
+
+    def commit(self):
+        pass  # the writer commits every write it runs
+
+    def rollback(self):
+        pass  # failed writes are rolled back on the writer thread
+
+    @contextmanager
+    def transaction(self):
+        """ collect the scope's writes and run them on the writer thread as one
+            write() when the outermost scope exits; a failing nested scope only
+            drops its own statements. Reads inside the scope come from readers
+            and do not see the queued writes.
+        """
+        assert self.connected, f"{self.__class__.__name__} is not connected"
+        pending = self._pending()
+        outermost = pending is None
+        if outermost:
+            pending = self._scopes.statements = []
+        mark = len(pending)
+        try:
+            yield self
+        except BaseException:
+            del pending[mark:]
+            if outermost:
+                self._scopes.statements = None
+            raise
+        if not outermost:
+            return
+        self._scopes.statements = None
+        if pending:
+            self.write(lambda writer: self._run_statements(writer, pending))
+
+    @staticmethod
+    def _run_statements(writer: SqliteConnection, statements: list):
+        for many, sql, params in statements:
+            if many:
+                writer.executemany(sql, params)
             else:
-                raise ValueError(
-                    f"Value {val} of type {type(val)} is yet to be handled"
-                )
-        return "(" + ", ".join(items) + ")"
-
-    def insert(self, table: str, rows: list):
-        sql = f""" INSERT INTO '{table}'
-                   VALUES {' '.join((self._make_row(r) for r in rows))} """
-        rid = self.db_conn.execute(sql)
-        logger.info(f"{len(rows)} records added to table {table}, now at row {rid}")
-
-    def get(self, table: str):
-        sql = f""" SELECT *
-                   FROM {table} """
-        return self.db_conn.fetch(sql)
+                writer.execute(sql, params)
+
+    @assert_connected
+    def fetch(self, sql: str, params: Sequence = (), record_type: type = None) -> list:
+        with self._reader_pool.connection() as reader:
+            return reader.fetch(sql, params, record_type)
+
+    @assert_connected
+    def iter_fetch(
+        self,
+        sql: str,
+        params: Sequence = (),
+        chunk_size: int = 1000,
+        record_type: type = None,
+    ) -> Iterator:
+        """ the reader stays checked out until the generator is exhausted or closed
+        """
+        with self._reader_pool.connection() as reader:
+            yield from reader.iter_fetch(sql, params, chunk_size, record_type)
+
+    @contextmanager
+    def cursor(self, sql: str, params: Sequence = ()):
+        assert self.connected, f"{self.__class__.__name__} is not connected"
+        with self._reader_pool.connection() as reader:
+            with reader.cursor(sql, params) as cur:
+                yield cur
+
+    @assert_connected
+    def explain(self, sql: str, params: Sequence = ()) -> List[str]:
+        with self._reader_pool.connection() as reader:
+            return reader.explain(sql, params)
+
+    @assert_connected
+    def tables_read(self, sql: str, params: Sequence = ()) -> Optional[List[str]]:
+        with self._reader_pool.connection() as reader:
+            return reader.tables_read(sql, params)
+
+
+class BufferedWriter:
+    """ Write-behind buffer around DBClient.insert for high-frequency producers
+        Rows are queued in memory and inserted in batches from a background thread
+        once max_rows, max_bytes or flush_interval seconds (since the oldest
+        buffered row) is reached, turning one commit per row into one per batch.
+        write blocks while capacity rows are waiting, and everything still buffered
+        is flushed on close / __exit__. A failed batch is logged and re-raised on
+        the next write, flush or close; its rows are not retried.
+        The client is used from the writer thread, see from_db_info for sqlite.
+    """
+
+    DEFAULT_MAX_ROWS = 1000
+    DEFAULT_MAX_BYTES = 1 << 20
+    DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+    DEFAULT_CAPACITY = 100_000
+
+    def __init__(
+        self,
+        client: DBClient,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        capacity: int = DEFAULT_CAPACITY,
+    ):
+        assert capacity >= max_rows > 0, "need capacity >= max_rows > 0"
+        self.client = client
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self._buffer: Dict[str, List[Sequence]] = {}
+        self._n_rows = 0
+        self._n_bytes = 0
+        self._oldest: Optional[float] = None
+        self._accepted = 0  # rows ever buffered
+        self._done = 0  # rows ever handed to the client, written or failed
+        self._flush_requested = False
+        self._closing = False
+        self._error: Optional[BaseException] = None
+        self._owns_client = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.__class__.__name__}", daemon=True
+        )
+
+    @classmethod
+    def from_db_info(cls, db_info: SqliteInfo, **kwargs) -> "BufferedWriter":
+        """ writer owning a sqlite connection that may be used off its thread
+        """
+        writer = cls(SqliteClient(SqliteConnection(db_info, False)), **kwargs)
+        writer._owns_client = True
+        return writer
+
+    def start(self):
+        if self._owns_client:
+            self.client.db_conn.connect()
+        self._thread.start()
+        return self
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def write(self, table: str, row: Sequence, timeout: Optional[float] = None):
+        with self._cond:
+            self._raise_error()
+            assert not self._closing, f"{self.__class__.__name__} is closed"
+            if not self._cond.wait_for(
+                lambda: self._n_rows < self.capacity or self._closing, timeout
+            ):
+                raise TimeoutError(f"write buffer still full after {timeout}s")
+            if self._closing:
+                # closed while we waited, the writer may already have drained
+                raise RuntimeError(f"{self.__class__.__name__} closed, row not written")
+            self._buffer.setdefault(table, []).append(row)
+            self._n_rows += 1
+            self._n_bytes += sum(map(sys.getsizeof, row))
+            self._accepted += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()  # writer starts the flush_interval timer
+            elif self._n_rows >= self.max_rows or self._n_bytes >= self.max_bytes:
+                self._cond.notify_all()
+
+    def write_many(self, table: str, rows: Iterable[Sequence]):
+        for row in rows:
+            self.write(table, row)
+
+    def flush(self, timeout: Optional[float] = None):
+        """ block until every row written so far has been handed to the client
+        """
+        with self._cond:
+            target = self._accepted
+            self._flush_requested = True
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._done >= target, timeout):
+                raise TimeoutError(f"flush did not finish within {timeout}s")
+            self._raise_error()
+
+    def _should_flush(self) -> bool:
+        if not self._n_rows:
+            return self._closing
+        return (
+            self._closing
+            or self._flush_requested
+            or self._n_rows >= self.max_rows
+            or self._n_bytes >= self.max_bytes
+            or time.monotonic() - self._oldest >= self.flush_interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._should_flush():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = self._oldest + self.flush_interval - time.monotonic()
+                    self._cond.wait(timeout)
+                if self._closing and not self._n_rows:
+                    return
+                buffer, n_rows = self._buffer, self._n_rows
+                self._buffer, self._n_rows, self._n_bytes = {}, 0, 0
+                self._oldest, self._flush_requested = None, False
+                self._cond.notify_all()  # producers can refill while we write
+            try:
+                for table, rows in buffer.items():
+                    self.client.insert(table, rows)
+            except Exception as e:
+                logger.exception(f"failed to write {n_rows} buffered rows")
+                with self._cond:
+                    self._error = e
+            with self._cond:
+                self._done += n_rows
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self._owns_client:
+            self.client.db_conn.disconnect()
+        self._raise_error()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
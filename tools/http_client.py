@@ -0,0 +1,211 @@
+""" Shared pooled HTTP client for the API wrappers
+
+    from tools.http_client import get_client
+
+    r = get_client().get("https://finnhub.io/api/v1/quote", params={...})
+"""
+import datetime as dt
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def redact_url(url: str) -> str:
+    """ scheme, host and path only, api keys often travel in the query string
+    """
+    parts = urlsplit(url)
+    netloc = parts.netloc.rpartition("@")[2]  # drop user:password@ as well
+    return parts._replace(netloc=netloc, query="", fragment="").geturl()
+
+
+class RateLimiter:
+    """ Token bucket shared between threads, acquire() blocks until a request
+        may go out so callers stay under rate per second, bursting up to burst
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        assert rate > 0 and burst >= 1
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """ take a token if one is free and return 0, else seconds until one is
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class HttpClient:
+    """ Keeps one keep-alive requests.Session per host, so polling loops reuse
+        TCP / TLS connections instead of a new handshake on every call
+        Each host gets a connection pool of at most pool_size connections,
+        callers beyond that wait for a free one. Every request gets timeout
+        unless given its own. Responses with a RETRY_STATUSES code, and
+        connection errors, are retried up to max_retries times after a
+        Retry-After delay or a jittered exponential backoff; requests with a
+        non idempotent method (POST, PATCH) are only retried on 429, which
+        means the server did not process them.
+    """
+
+    DEFAULT_TIMEOUT = (3.05, 30.0)  # connect, read
+    POOL_SIZE = 10
+    MAX_RETRIES = 3
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30.0
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(
+        self,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        pool_size: int = POOL_SIZE,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+    ):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.pool_size, pool_block=True
+                    )
+                    session.mount(host, adapter)
+                    self._sessions[host] = session
+                    logger.debug(f"opened session for {host}")
+        return session
+
+    def backoff(self, attempt: int) -> float:
+        """ full jitter, so clients retrying together do not stay in step
+        """
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> Optional[float]:
+        """ seconds asked for by a Retry-After header, in seconds or as a date
+        """
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (at - dt.datetime.now(dt.timezone.utc)).total_seconds())
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        method = method.upper()
+        idempotent = method in self.IDEMPOTENT_METHODS
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.session(url)
+        safe_url = redact_url(url)
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                # the exception message repeats the full url, log its type only
+                logger.warning(
+                    f"{method} {safe_url} failed with {e.__class__.__name__}, "
+                    f"retry in {delay:.1f}s"
+                )
+            else:
+                retryable = response.status_code == 429 or (
+                    idempotent and response.status_code in self.RETRY_STATUSES
+                )
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                delay = min(delay, self.backoff_max)
+                logger.warning(
+                    f"{method} {safe_url} returned {response.status_code}, "
+                    f"retry in {delay:.1f}s"
+                )
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """ process wide client shared by all API wrappers
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
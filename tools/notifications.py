@@ -0,0 +1,273 @@
+""" Background notification dispatch for the monitors
+
+    dispatcher = NotificationDispatcher(TwilioTextSender.from_creds_file(...))
+    delivery = dispatcher.send_message("TSLA 🔺 3.2%")  # returns right away
+    delivery.wait(10)
+"""
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from difflib import SequenceMatcher
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from tools.http_client import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery:
+    """ Handle for a message handed to the dispatcher
+        status goes queued -> sending -> sent / failed (back to queued between
+        retries), or coalesced when the message was merged into a similar one;
+        a coalesced delivery completes with the message it was merged into.
+    """
+
+    def __init__(self, recipient: Optional[str], body: str):
+        self.recipient = recipient
+        self.body = body
+        self.status = "queued"
+        self.attempts = 0
+        self.coalesced_into: Optional["Delivery"] = None
+        self._future: Future = Future()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.recipient}, {self.status})"
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ True once delivered, False if it failed or timeout passed first
+        """
+        try:
+            self._future.result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """ what the sender returned, raises the send error if it failed
+        """
+        return self._future.result(timeout)
+
+    def _merge(self, into: "Delivery"):
+        self.status = "coalesced"
+        self.coalesced_into = into
+
+        def copy(done: Future):
+            if done.exception() is not None:
+                self._future.set_exception(done.exception())
+            else:
+                self._future.set_result(done.result())
+
+        into._future.add_done_callback(copy)
+
+
+class NotificationDispatcher:
+    """ Queues messages and sends them from background workers, so a monitor's
+        run() does not wait on the sms API
+        A message within similarity (difflib ratio) of one sent or queued for
+        the same recipient in the last coalesce_window seconds is coalesced:
+        a still queued message takes the newer text, an already sent one is not
+        repeated, and one being sent is followed by the newer text. Each recipient may get at most rate_per_minute messages, with
+        bursts of burst; messages over the limit wait their turn without
+        holding up other recipients. Failed sends are retried up to
+        max_attempts times. The sender needs send_message(body), or
+        send_message(body, to_number=recipient) when sending to recipients.
+    """
+
+    DEFAULT_WORKERS = 2
+    COALESCE_WINDOW = 300.0
+    SIMILARITY = 0.9
+    RATE_PER_MINUTE = 6.0
+    BURST = 3
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 5.0
+
+    def __init__(
+        self,
+        sender,
+        workers: int = DEFAULT_WORKERS,
+        coalesce_window: float = COALESCE_WINDOW,
+        similarity: float = SIMILARITY,
+        rate_per_minute: float = RATE_PER_MINUTE,
+        burst: int = BURST,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.sender = sender
+        self.coalesce_window = coalesce_window
+        self.similarity = similarity
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.sent = self.coalesced = self.failed = 0
+        self._heap: List[Tuple[float, int, Delivery]] = []  # (ready at, seq, ...)
+        self._seq = 0
+        self._recent: Dict[Optional[str], Deque[Tuple[float, Delivery]]] = {}
+        self._limiters: Dict[Optional[str], RateLimiter] = {}
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"notify-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.close)  # deliver what is queued when the app exits
+
+    def _similar(self, a: str, b: str) -> bool:
+        if a == b:
+            return True
+        matcher = SequenceMatcher(None, a, b)
+        # the quick ratios are cheap upper bounds, most pairs stop there
+        return (
+            matcher.real_quick_ratio() >= self.similarity
+            and matcher.quick_ratio() >= self.similarity
+            and matcher.ratio() >= self.similarity
+        )
+
+    def _push(self, delivery: Delivery, ready_at: float):
+        self._seq += 1
+        heapq.heappush(self._heap, (ready_at, self._seq, delivery))
+        self._cond.notify_all()  # flush() waits on the same condition
+
+    def send(self, body: str, recipient: Optional[str] = None) -> Delivery:
+        delivery = Delivery(recipient, body)
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("dispatcher is closed")
+            recent = self._recent.setdefault(recipient, deque())
+            while recent and now - recent[0][0] > self.coalesce_window:
+                recent.popleft()
+            for _, earlier in reversed(recent):
+                if earlier.status in ("queued", "sending", "sent") and self._similar(
+                    earlier.body, body
+                ):
+                    if earlier.status == "sending":
+                        break  # the older text is on its way, queue the newer one
+                    if earlier.status == "queued":
+                        earlier.body = body  # send the latest version
+                    delivery._merge(earlier)
+                    self.coalesced += 1
+                    logger.info(f"coalesced message to {recipient} into {earlier}")
+                    return delivery
+            recent.append((now, delivery))
+            self._push(delivery, now)
+        return delivery
+
+    def send_message(self, message_body: str) -> Delivery:
+        """ drop-in for TwilioTextSender.send_message
+        """
+        return self.send(message_body)
+
+    def _limiter(self, recipient: Optional[str]) -> RateLimiter:
+        limiter = self._limiters.get(recipient)
+        if limiter is None:
+            limiter = RateLimiter(self.rate_per_minute / 60, self.burst)
+            self._limiters[recipient] = limiter
+        return limiter
+
+    def _next(self) -> Optional[Delivery]:
+        """ block until a delivery is due and its recipient is under the limit
+        """
+        with self._cond:
+            while True:
+                if not self._heap:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                ready_at, _, delivery = self._heap[0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._heap)
+                wait = self._limiter(delivery.recipient).try_acquire()
+                if wait:
+                    self._push(delivery, now + wait)
+                    continue
+                self._in_flight += 1
+                delivery.status = "sending"
+                return delivery
+
+    def _deliver(self, delivery: Delivery):
+        delivery.attempts += 1
+        try:
+            if delivery.recipient is None:
+                result = self.sender.send_message(delivery.body)
+            else:
+                result = self.sender.send_message(
+                    delivery.body, to_number=delivery.recipient
+                )
+        except Exception as e:
+            with self._cond:
+                if delivery.attempts < self.max_attempts:
+                    delay = self.RETRY_DELAY * 2 ** (delivery.attempts - 1)
+                    logger.warning(f"sending {delivery} failed: {e!r}, retry {delay}s")
+                    delivery.status = "queued"
+                    self._push(delivery, time.monotonic() + delay)
+                    return
+                delivery.status = "failed"
+                self.failed += 1
+            logger.error(f"giving up on {delivery} after {delivery.attempts} attempts")
+            delivery._future.set_exception(e)
+        else:
+            with self._cond:
+                delivery.status = "sent"
+                self.sent += 1
+            delivery._future.set_result(result)
+
+    def _work(self):
+        while True:
+            delivery = self._next()
+            if delivery is None:
+                return
+            try:
+                self._deliver(delivery)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """ wait until everything queued so far is sent or failed
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._heap and not self._in_flight, timeout
+            )
+
+    def close(self, timeout: Optional[float] = 30.0):
+        """ stop taking messages, deliver the queued ones and stop the workers
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            worker.join(remaining if remaining is None else max(0.0, remaining))
+        atexit.unregister(self.close)
+        logger.info(
+            f"dispatcher closed: {self.sent} sent, {self.coalesced} coalesced, "
+            f"{self.failed} failed"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "in_flight": self._in_flight,
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+            }
@@ -1,24 +1,559 @@
+import asyncio
+import copy
+import datetime as dt
+import heapq
+import importlib
+import json
 import logging
+import math
+import multiprocessing
+import os
+import pickle
+import queue
+import random
+import socket
+import sys
+import threading
 import time
+import tracemalloc
 from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from zoneinfo import ZoneInfo
+
+from tools.db_utils import SqliteClient, SqliteInfo
+
+try:
+    import resource
+except ImportError:  # not available on windows, cpu limits are skipped there
+    resource = None
 
 logger = logging.getLogger(__name__)
 
 
+class AdaptiveInterval:
+    """ Polling interval policy fed by how far a service is from its trigger
+        observe() takes a distance normalised to [0, 1], 0 being at the trigger
+        (e.g. 1 - move / threshold) and 1 or more being far away. The interval
+        scales from min_interval at the trigger to base_interval when far, then
+        backs off exponentially up to max_interval while the distance does not
+        move by more than min_change. With a budget of api calls per
+        budget_period the interval never drops below what is left of the budget
+        spread over what is left of the period.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        base_interval: float,
+        max_interval: Optional[float] = None,
+        budget: Optional[int] = None,
+        budget_period: float = 86400,
+        backoff: float = 2.0,
+        min_change: float = 0.05,
+    ):
+        assert 0 < min_interval <= base_interval
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval or base_interval * 8
+        self.budget = budget
+        self.budget_period = budget_period
+        self.backoff = backoff
+        self.min_change = min_change
+        self.distance: Optional[float] = None
+        self.unchanged = 0  # observations in a row without a significant change
+        # past this many even min_interval has backed off to max_interval
+        self._max_unchanged = (
+            math.ceil(math.log(self.max_interval / min_interval, backoff))
+            if backoff > 1 and self.max_interval > min_interval
+            else 0
+        )
+        self.calls = 0  # api calls in the current budget period
+        self._period_start = time.monotonic()
+
+    def observe(self, distance: float, calls: int = 1):
+        """ record one poll, costing calls api calls, that found the trigger
+            distance away
+        """
+        distance = min(max(distance, 0.0), 1.0)
+        previous = self.distance
+        if previous is not None and abs(distance - previous) < self.min_change:
+            self.unchanged = min(self.unchanged + 1, self._max_unchanged)
+        else:
+            self.unchanged = 0
+            self.distance = distance
+        self._roll_period()
+        self.calls += calls
+
+    def _roll_period(self):
+        now = time.monotonic()
+        if now - self._period_start >= self.budget_period:
+            periods = (now - self._period_start) // self.budget_period
+            self._period_start += periods * self.budget_period
+            self.calls = 0
+
+    def _budget_floor(self) -> float:
+        if not self.budget:
+            return 0.0
+        self._roll_period()
+        period_left = self._period_start + self.budget_period - time.monotonic()
+        calls_left = self.budget - self.calls
+        if calls_left <= 0:
+            return period_left  # spent, wait for the next period
+        return period_left / calls_left
+
+    def next_interval(self) -> float:
+        if self.distance is None:
+            return self.base_interval
+        span = self.base_interval - self.min_interval
+        interval = self.min_interval + span * self.distance
+        interval = min(interval * self.backoff ** self.unchanged, self.max_interval)
+        return max(interval, self._budget_floor())
+
+
+class CheckpointStore:
+    """ Compact local store for service state, restored at start
+        State is a flat dict of json serialisable entries. save() appends only the
+        entries that changed since the last save (and deletions) as json lines,
+        load() replays the log. Once the log holds compact_ratio times more lines
+        than live entries it is rewritten with just the live ones, atomically.
+    """
+
+    COMPACT_RATIO = 2
+    MIN_COMPACT_LINES = 1000
+
+    def __init__(self, file_loc: str, fsync: bool = False):
+        self.file_loc = file_loc
+        self.fsync = fsync
+        self._written: Dict[str, str] = {}  # key -> serialised value on disk
+        self._lines = 0
+
+    def load(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        self._written, self._lines = {}, 0
+        if not os.path.exists(self.file_loc):
+            return state
+        torn = False
+        with open(self.file_loc) as f:
+            for line in f:
+                torn = torn or not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"skipping torn checkpoint line in {self.file_loc}")
+                    torn = True
+                    continue
+                self._lines += 1
+                key = entry["k"]
+                if "v" in entry:
+                    state[key] = entry["v"]
+                    # same serialisation save() compares against
+                    self._written[key] = json.dumps(entry["v"], sort_keys=True)
+                else:
+                    state.pop(key, None)
+                    self._written.pop(key, None)
+        if torn:  # later appends would be glued onto the torn line
+            self.compact()
+        logger.info(f"restored {len(state)} entries from {self.file_loc}")
+        return state
+
+    def save(self, state: Dict[str, Any]) -> int:
+        """ append changes since the last save, returns number of lines written
+        """
+        lines = []
+        serialised = {k: json.dumps(v, sort_keys=True) for k, v in state.items()}
+        for key, value in serialised.items():
+            if self._written.get(key) != value:
+                lines.append(f'{{"k": {json.dumps(key)}, "v": {value}}}\n')
+        for key in self._written.keys() - serialised.keys():
+            lines.append(f'{{"k": {json.dumps(key)}}}\n')
+        if not lines:
+            return 0
+        self._written = serialised
+        self._lines += len(lines)
+        live = len(serialised)
+        if self._lines > max(self.COMPACT_RATIO * live, self.MIN_COMPACT_LINES):
+            self.compact()
+        else:
+            self._write(lines, "a")
+        return len(lines)
+
+    def compact(self):
+        lines = [
+            f'{{"k": {json.dumps(k)}, "v": {v}}}\n' for k, v in self._written.items()
+        ]
+        tmp_loc = f"{self.file_loc}.tmp"
+        self._write(lines, "w", tmp_loc)
+        os.replace(tmp_loc, self.file_loc)
+        self._lines = len(lines)
+        logger.info(f"compacted {self.file_loc} to {len(lines)} entries")
+
+    def _write(self, lines: List[str], mode: str, file_loc: Optional[str] = None):
+        with open(file_loc or self.file_loc, mode) as f:
+            f.writelines(lines)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class RunProfiler:
+    """ Opt-in sampling profiler and memory tracker for service runs
+        While a run is profiled a daemon thread samples the running thread's
+        stack every sample_interval seconds; counts accumulate across runs and
+        are rewritten after each run to <output_dir>/<name>.collapsed, one
+        "frame;frame;frame count" line per stack, ready for flamegraph.pl or
+        speedscope. With memory_every set, tracemalloc runs for the service's
+        lifetime and every memory_every runs the top allocation growth since
+        the previous snapshot is written to <name>.alloc.<run>.txt.
+    """
+
+    DEFAULT_SAMPLE_INTERVAL = 0.01
+    TOP_ALLOCATIONS = 25
+
+    def __init__(
+        self,
+        output_dir: str,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+        memory_every: Optional[int] = None,
+        memory_frames: int = 1,
+    ):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.memory_every = memory_every
+        self.memory_frames = memory_frames
+        self.stacks: Dict[str, Counter] = {}
+        self.runs: Dict[str, int] = {}
+        self._snapshots: Dict[str, tracemalloc.Snapshot] = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self, thread_id: int, stacks: Counter, done: threading.Event):
+        while not done.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[self._collapse(frame)] += 1
+
+    def profile(self, name: str, fn: Callable[[], Any]) -> Any:
+        run = self.runs[name] = self.runs.get(name, 0) + 1
+        if self.memory_every and not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+        stacks = self.stacks.setdefault(name, Counter())
+        done = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), stacks, done),
+            name=f"profiler-{name}",
+            daemon=True,
+        )
+        sampler.start()
+        try:
+            return fn()
+        finally:
+            done.set()
+            sampler.join()
+            self._write_stacks(name)
+            if self.memory_every and run % self.memory_every == 0:
+                self._write_allocations(name, run)
+
+    def _write_stacks(self, name: str):
+        with open(os.path.join(self.output_dir, f"{name}.collapsed"), "w") as f:
+            for stack, count in self.stacks[name].most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _write_allocations(self, name: str, run: int):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        previous = self._snapshots.get(name)
+        self._snapshots[name] = snapshot
+        if previous is None:
+            stats = snapshot.statistics("lineno")
+            header = f"top allocations after run {run}"
+        else:
+            stats = snapshot.compare_to(previous, "lineno")
+            header = f"allocation growth up to run {run}"
+        file_loc = os.path.join(self.output_dir, f"{name}.alloc.{run}.txt")
+        with open(file_loc, "w") as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f"{header}, traced {current:,} bytes, peak {peak:,} bytes\n")
+            for stat in stats[: self.TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        logger.info(f"wrote allocation report {file_loc}")
+
+
+class ActiveWindow:
+    """ Calendar of when a service should run, e.g. trading hours
+        Daily hours from start to end (wrapping past midnight when end <= start)
+        on the given weekdays (0 is Monday) in time zone tz, skipping holidays.
+        Open intervals are precomputed as epoch seconds for horizon_days and
+        indexed by utc day, so is_active is a dict lookup and a comparison or
+        two; the calendar is extended once time runs past its horizon. Times
+        outside it are answered from a throwaway calendar built around them.
+    """
+
+    HORIZON_DAYS = 366
+
+    def __init__(
+        self,
+        start: dt.time,
+        end: dt.time,
+        weekdays: Iterable[int] = range(5),
+        tz: str = "UTC",
+        holidays: Iterable[dt.date] = (),
+        horizon_days: int = HORIZON_DAYS,
+    ):
+        self.start = start
+        self.end = end
+        self.weekdays = frozenset(weekdays)
+        self.tz = ZoneInfo(tz)
+        self.holidays = frozenset(holidays)
+        self.horizon_days = horizon_days
+        self._opens: List[float] = []
+        self._closes: List[float] = []
+        self._by_day: Dict[int, List[Tuple[float, float]]] = {}
+        self._start = self._horizon = 0.0
+        self._build(time.time())
+
+    @classmethod
+    def from_serializable(cls, config: Dict) -> "ActiveWindow":
+        """ {"start": "09:30", "end": "16:00", "weekdays": [0, 1, 2, 3, 4],
+             "tz": "America/New_York", "holidays": ["2026-12-25"],
+             "holidays_file": "market_holidays.json"}
+            holidays_file holds a json list of dates, added to holidays
+        """
+        holidays = list(config.get("holidays", []))
+        if config.get("holidays_file"):
+            with open(config["holidays_file"]) as f:
+                holidays.extend(json.load(f))
+        return cls(
+            dt.time.fromisoformat(config["start"]),
+            dt.time.fromisoformat(config["end"]),
+            config.get("weekdays", range(5)),
+            config.get("tz", "UTC"),
+            [dt.date.fromisoformat(d) for d in holidays],
+        )
+
+    def _build(self, now: float, warn: bool = True):
+        # start a day early so a window spanning midnight into today is included
+        first = dt.datetime.fromtimestamp(now, self.tz).date() - dt.timedelta(days=1)
+        self._start = dt.datetime.combine(
+            first + dt.timedelta(days=1), dt.time(), self.tz
+        ).timestamp()
+        self._opens, self._closes, self._by_day = [], [], {}
+        for offset in range(self.horizon_days + 1):
+            day = first + dt.timedelta(days=offset)
+            if day.weekday() not in self.weekdays or day in self.holidays:
+                continue
+            open_at = dt.datetime.combine(day, self.start, self.tz)
+            close_day = day if self.end > self.start else day + dt.timedelta(days=1)
+            close_at = dt.datetime.combine(close_day, self.end, self.tz)
+            opens, closes = open_at.timestamp(), close_at.timestamp()
+            self._opens.append(opens)
+            self._closes.append(closes)
+            for utc_day in range(int(opens // 86400), int(closes // 86400) + 1):
+                self._by_day.setdefault(utc_day, []).append((opens, closes))
+        self._horizon = now + (self.horizon_days - 1) * 86400
+        if warn and self.holidays and day.year > max(self.holidays).year:
+            logger.warning(
+                f"no holidays listed past {max(self.holidays).year}, the window "
+                f"stays open on holidays up to {day}; update the holiday list"
+            )
+
+    def _calendar(self, at: float) -> "ActiveWindow":
+        now = time.time()
+        if now >= self._horizon:
+            self._build(now)
+        if self._start <= at < self._horizon:
+            return self
+        # far from now, keep the calendar around now and answer from a copy
+        calendar = copy.copy(self)
+        calendar._build(at, warn=False)
+        return calendar
+
+    def is_active(self, at: Optional[float] = None) -> bool:
+        """ whether epoch time at (default now) falls in the window
+        """
+        at = time.time() if at is None else at
+        by_day = self._calendar(at)._by_day
+        return any(o <= at < c for o, c in by_day.get(int(at // 86400), ()))
+
+    def seconds_until_active(self, at: Optional[float] = None) -> float:
+        """ 0 while the window is open, else seconds until it next opens
+        """
+        at = time.time() if at is None else at
+        if self.is_active(at):
+            return 0.0
+        opens = self._calendar(at)._opens
+        i = bisect_right(opens, at)
+        if i == len(opens):
+            raise ValueError(f"window never opens within {self.horizon_days} days")
+        return opens[i] - at
+
+
+class LeaderLease:
+    """ Leader election among service replicas through a sqlite lease table
+        A heartbeat thread takes or renews the lease every ttl / 3 seconds; the
+        upsert only succeeds while the lease is free, expired or already ours,
+        so one replica holds it at a time and a standby takes over at most ttl
+        seconds after the leader stops renewing. Replicas must share db_file,
+        i.e. run on one host or on storage with working sqlite locks.
+    """
+
+    TABLE = "_service_leases"
+    DEFAULT_TTL = 10.0
+
+    def __init__(
+        self,
+        db_file: str,
+        name: str,
+        ttl: float = DEFAULT_TTL,
+        holder: Optional[str] = None,
+    ):
+        self.db_info = SqliteInfo(db_file)
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self._valid_until = 0.0  # monotonic time our lease is safe to use until
+        self._decided = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        if self._thread is None:
+            self.start()
+        return time.monotonic() < self._valid_until
+
+    def _try_acquire(self, client: SqliteClient) -> bool:
+        sent = time.monotonic()  # count the ttl from before the write, to be safe
+        now = time.time()
+        client.execute(
+            f"INSERT INTO {self.TABLE} (name, holder, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "holder = excluded.holder, expires = excluded.expires "
+            f"WHERE {self.TABLE}.holder = excluded.holder "
+            f"OR {self.TABLE}.expires < ?",
+            (self.name, self.holder, now + self.ttl, now),
+        )
+        rows = client.fetch(
+            f"SELECT holder FROM {self.TABLE} WHERE name = ?", (self.name,)
+        )
+        held = bool(rows) and rows[0][0] == self.holder
+        self._valid_until = sent + self.ttl if held else 0.0
+        return held
+
+    def _heartbeat(self):
+        with SqliteClient.from_db_info(self.db_info) as client:
+            client.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} "
+                "(name text PRIMARY KEY, holder text, expires real)"
+            )
+            leader = False
+            while not self._stopped.is_set():
+                try:
+                    held = self._try_acquire(client)
+                except Exception:
+                    logger.exception(f"could not renew lease {self.name}")
+                    held = False  # lapses by itself once _valid_until passes
+                if held != leader:
+                    leader = held
+                    state = "acquired" if held else "lost"
+                    logger.info(f"{self.holder} {state} lease {self.name}")
+                self._decided.set()
+                self._stopped.wait(self.ttl / 3)
+            if leader:
+                self._valid_until = 0.0
+                client.execute(
+                    f"DELETE FROM {self.TABLE} WHERE name = ? AND holder = ?",
+                    (self.name, self.holder),
+                )
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._heartbeat, name=f"lease-{self.name}", daemon=True
+        )
+        self._thread.start()
+        self._decided.wait(self.ttl)
+
+    def release(self):
+        """ stop renewing and hand the lease over right away
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
 class SynchronousService(ABC):
     """ Very simple synchronous service template
+        Set interval_policy to an AdaptiveInterval, and feed it from run(), to
+        have start() poll at adaptive rather than fixed intervals. Set checkpoint
+        to a CheckpointStore and implement get_state / set_state to keep state
+        across restarts, profiler to a RunProfiler to profile runs and
+        active_window to an ActiveWindow to sleep through inactive periods.
+        With leader_lease set to a LeaderLease shared by replicas of a service,
+        only the replica holding the lease runs, the others stand by.
     """
 
     DEFAULT_INTERVAL = 3600  # default to hourly update
+    interval_policy: Optional[AdaptiveInterval] = None
+    checkpoint: Optional[CheckpointStore] = None
+    profiler: Optional[RunProfiler] = None
+    active_window: Optional[ActiveWindow] = None
+    leader_lease: Optional[LeaderLease] = None
+    _leading: bool = False
 
     def start(self, interval: int = DEFAULT_INTERVAL):
         """ simply invoke run and go to sleep until time is up
         """
         logger.info(f"starting {self.__class__.__name__}")
+        if self.checkpoint is not None:
+            self.set_state(self.checkpoint.load())
+        deadline = time.monotonic()
         while True:
-            self.run()
-            logger.info(f"sleeping for {interval}")
-            time.sleep(interval)
+            if self.active_window is not None:
+                closed_for = self.active_window.seconds_until_active()
+                if closed_for:
+                    logger.info(f"outside active window, sleeping for {closed_for:.0f}")
+                    time.sleep(closed_for)
+                    deadline = time.monotonic()
+            self.run_once()
+            if self.checkpoint is not None:
+                self.checkpoint.save(self.get_state())
+            if self.interval_policy is not None:
+                interval = self.interval_policy.next_interval()
+            # plan against deadlines so the period does not drift by run time
+            deadline += interval
+            now = time.monotonic()
+            if deadline < now:
+                skipped = int((now - deadline) // interval) + 1
+                logger.warning(f"run overran, skipping {skipped} interval(s)")
+                deadline += skipped * interval
+            logger.info(f"sleeping for {deadline - now:.1f}")
+            time.sleep(deadline - now)
 
     @abstractmethod
     def run(self):
@@ -27,3 +562,667 @@ class SynchronousService(ABC):
     @abstractmethod
     def stop(self):
         raise NotImplementedError
+
+    def run_once(self) -> Any:
+        """ run, under the profiler if one is set, unless a standby replica
+        """
+        if self.leader_lease is not None and not self._lead():
+            return None
+        if self.profiler is None:
+            return self.run()
+        return self.profiler.profile(self.__class__.__name__, self.run)
+
+    def _lead(self) -> bool:
+        leading = self.leader_lease.is_leader
+        if leading and not self._leading and self.checkpoint is not None:
+            # pick up where the previous leader left off, e.g. alerts it sent
+            self.set_state(self.checkpoint.load())
+        elif not leading:
+            logger.info(f"{self.__class__.__name__} standing by, not the leader")
+        self._leading = leading
+        return leading
+
+    def get_state(self) -> Dict[str, Any]:
+        """ state to checkpoint as a flat dict of json serialisable entries, many
+            small entries are cheaper to save than one big one
+        """
+        return {}
+
+    def set_state(self, state: Dict[str, Any]):
+        pass
+
+
+class AsyncService(ABC):
+    """ Coroutine based service template, run many of them in one ServiceHost
+    """
+
+    DEFAULT_INTERVAL = 3600
+    active_window: Optional[ActiveWindow] = None
+
+    @abstractmethod
+    async def run(self):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class _ServiceRetired(Exception):
+    """ a hosted service called quit() / raised SystemExit
+    """
+
+
+@dataclass
+class HostedService:
+    service: Union[SynchronousService, AsyncService]
+    interval: float
+    timeout: Optional[float] = None  # seconds per run, None to let runs finish
+    max_overlap: int = 1  # runs of this service allowed in flight at once
+
+    @property
+    def name(self):
+        return self.service.__class__.__name__
+
+
+class ServiceHost:
+    """ Runs any number of services concurrently on one event loop
+        Each service is started every interval seconds. Runs that would exceed
+        max_overlap are skipped, runs longer than timeout are abandoned. Blocking
+        SynchronousService.run calls are offloaded to a thread pool; a timed out
+        thread cannot be killed, so it keeps its overlap slot until it returns.
+        A service calling quit() / raising SystemExit is retired from the host.
+    """
+
+    DEFAULT_THREADS = 16
+
+    def __init__(self, max_threads: int = DEFAULT_THREADS):
+        self.max_threads = max_threads
+        self.services: List[HostedService] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._runs: Set[asyncio.Future] = set()
+
+    def add(
+        self,
+        service: Union[SynchronousService, AsyncService],
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_overlap: int = 1,
+    ) -> HostedService:
+        hosted = HostedService(
+            service, interval or service.DEFAULT_INTERVAL, timeout, max_overlap
+        )
+        self.services.append(hosted)
+        return hosted
+
+    @staticmethod
+    async def _run_async(service: AsyncService):
+        # a task re-raises SystemExit out of the event loop, stopping the host
+        try:
+            return await service.run()
+        except SystemExit:
+            raise _ServiceRetired() from None
+
+    @staticmethod
+    def _run_sync(service: SynchronousService):
+        try:
+            return service.run_once()
+        except SystemExit:
+            raise _ServiceRetired() from None
+
+    def _start_run(self, hosted: HostedService) -> asyncio.Future:
+        if isinstance(hosted.service, AsyncService):
+            return asyncio.ensure_future(self._run_async(hosted.service))
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, self._run_sync, hosted.service)
+
+    async def _run_once(
+        self, hosted: HostedService, slots: asyncio.Semaphore, retired: asyncio.Event
+    ):
+        def finished(run: asyncio.Future):
+            slots.release()
+            if not run.cancelled() and isinstance(run.exception(), _ServiceRetired):
+                logger.info(f"{hosted.name} exited, no longer scheduled")
+                retired.set()
+
+        run = self._start_run(hosted)
+        run.add_done_callback(finished)
+        try:
+            await asyncio.wait_for(asyncio.shield(run), hosted.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{hosted.name} run exceeded {hosted.timeout}s, abandoned")
+            if isinstance(hosted.service, AsyncService):
+                run.cancel()
+        except _ServiceRetired:
+            pass  # handled once the run is done
+        except Exception:
+            logger.exception(f"{hosted.name} run failed")
+
+    async def _schedule(self, hosted: HostedService):
+        slots = asyncio.Semaphore(hosted.max_overlap)
+        retired = asyncio.Event()
+        next_run = time.monotonic()
+        window = hosted.service.active_window
+        while not retired.is_set():
+            closed_for = window.seconds_until_active() if window else 0
+            if closed_for:
+                logger.info(f"{hosted.name} outside active window, {closed_for:.0f}s")
+                try:
+                    await asyncio.wait_for(retired.wait(), closed_for)
+                except asyncio.TimeoutError:
+                    pass
+                next_run = time.monotonic()
+                continue
+            if slots.locked():
+                logger.warning(f"{hosted.name} still running, skipping this run")
+            else:
+                await slots.acquire()
+                task = asyncio.ensure_future(self._run_once(hosted, slots, retired))
+                self._runs.add(task)  # keep a reference until the run is done
+                task.add_done_callback(self._runs.discard)
+            next_run += hosted.interval
+            try:
+                await asyncio.wait_for(
+                    retired.wait(), max(0.0, next_run - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve(self):
+        self._executor = ThreadPoolExecutor(self.max_threads, "service-host")
+        logger.info(f"hosting {[h.name for h in self.services]}")
+        try:
+            await asyncio.gather(*(self._schedule(h) for h in self.services))
+        finally:
+            for hosted in self.services:
+                if isinstance(hosted.service, AsyncService):
+                    await hosted.service.stop()
+            self._executor.shutdown(wait=False)
+
+    def start(self):
+        asyncio.run(self.serve())
+
+
+# ~~~~~~~~~~~~~~~~ scheduling ~~~~~~~~~~~~~~~~~~
+class ScheduleSpec(ABC):
+    @abstractmethod
+    def next_after(self, deadline: float) -> float:
+        """ next monotonic deadline after the previous one
+        """
+        raise NotImplementedError
+
+
+@dataclass
+class IntervalSpec(ScheduleSpec):
+    every: float  # seconds
+
+    def next_after(self, deadline: float) -> float:
+        next_deadline = deadline + self.every
+        now = time.monotonic()
+        if next_deadline < now:  # fell behind, skip missed runs instead of bursting
+            next_deadline += ((now - next_deadline) // self.every + 1) * self.every
+        return next_deadline
+
+
+class CronSpec(ScheduleSpec):
+    """ Standard 5 field cron expression (minute hour day month weekday) in local
+        time, supporting *, lists, ranges and steps, e.g. "*/5 9-16 * * 1-5".
+        Weekdays run 0-6 from Sunday (7 is Sunday too); as in cron, when both day
+        and weekday are restricted a time matching either fires.
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    MAX_LOOKAHEAD = dt.timedelta(days=366 * 5)
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields, got {expr!r}")
+        parsed = [self._parse(p, lo, hi) for p, (lo, hi) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.expr!r})"
+
+    @staticmethod
+    def _parse(part: str, lo: int, hi: int) -> Set[int]:
+        values = set()
+        for item in part.split(","):
+            item, _, step = item.partition("/")
+            if item == "*":
+                start, end = lo, hi
+            elif "-" in item:
+                start, end = map(int, item.split("-"))
+            else:
+                start = end = int(item)
+            if not lo <= start <= end <= hi:
+                raise ValueError(f"cron field {part!r} out of range {lo}-{hi}")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def _day_matches(self, day: dt.datetime) -> bool:
+        in_days = day.day in self.days
+        # python weekday() is 0 for Monday, cron counts from Sunday
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_time(self, after: dt.datetime) -> dt.datetime:
+        t = after.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        limit = after + self.MAX_LOOKAHEAD
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + dt.timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + dt.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + dt.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += dt.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"{self} never fires")
+
+    def next_after(self, deadline: float) -> float:
+        # cron fires on the wall clock, translate back onto the monotonic clock
+        now = dt.datetime.now()
+        delay = (self.next_time(now) - now).total_seconds()
+        return time.monotonic() + delay
+
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable[[], None]
+    spec: ScheduleSpec
+    jitter: float = 0.0  # up to this many seconds are added to every run
+    window: Optional[ActiveWindow] = None  # runs outside it are put off
+    deadline: float = 0.0  # planned time of the next run, without jitter
+    running: bool = field(default=False, compare=False)
+
+
+class Scheduler:
+    """ Drift-free scheduler hosting many jobs on a heap-based timer queue
+        Deadlines live on the monotonic clock and the next one is planned from
+        the previous deadline, not from when a run finished. Random jitter is
+        added per run so jobs sharing a schedule do not hit an API in lockstep.
+        One thread sleeps until the earliest deadline and hands due jobs to a
+        worker pool, so idle schedules cost nothing; a job still running when it
+        is due again is skipped for that round.
+    """
+
+    DEFAULT_WORKERS = 8
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self.max_workers = max_workers
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[tuple] = []  # (fire time, seq, job)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _push(self, job: Job):
+        fire_at = job.deadline + random.uniform(0, job.jitter)
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at, self._seq, job))
+        self._cond.notify()
+
+    def add_job(
+        self,
+        name: str,
+        fn: Callable[[], None],
+        every: Optional[float] = None,
+        cron: Optional[str] = None,
+        jitter: float = 0.0,
+        run_now: bool = False,
+        window: Optional[ActiveWindow] = None,
+    ) -> Job:
+        assert (every is None) != (cron is None), "give exactly one of every / cron"
+        spec = IntervalSpec(every) if cron is None else CronSpec(cron)
+        job = Job(name, fn, spec, jitter, window)
+        now = time.monotonic()
+        job.deadline = now if run_now else spec.next_after(now)
+        with self._cond:
+            assert name not in self.jobs, f"job {name} already scheduled"
+            self.jobs[name] = job
+            self._push(job)
+        logger.info(f"scheduled {name} with {spec}, jitter {jitter}s")
+        return job
+
+    def add_service(
+        self, service: SynchronousService, name: Optional[str] = None, **kwargs
+    ) -> Job:
+        name = name or service.__class__.__name__
+        kwargs.setdefault("window", service.active_window)
+        return self.add_job(name, service.run_once, **kwargs)
+
+    def remove_job(self, name: str):
+        with self._cond:
+            self.jobs.pop(name, None)  # its heap entry is dropped when it comes up
+
+    @classmethod
+    def from_config(cls, file_loc: str) -> "Scheduler":
+        """ build a scheduler from a json file such as
+            {"max_workers": 8, "jobs": [{
+                "name": "tsla",
+                "target": "daily.day36.stock_news_alert:StockPriceMonitor",
+                "factory": "from_serializable",
+                "config": {"ticker": "TSLA", ...},
+                "every": 300,
+                "jitter": 30,
+                "window": {"start": "09:30", "end": "16:00", "tz": "America/New_York"}
+            }, {"name": "...", "target": "pkg.module:function", "cron": "0 9 * * 1-5"}]}
+            targets are SynchronousService subclasses built with factory(config)
+            (or the class itself with config as kwargs), or plain callables
+        """
+        with open(file_loc) as f:
+            config = json.load(f)
+        scheduler = cls(config.get("max_workers", cls.DEFAULT_WORKERS))
+        for job in config["jobs"]:
+            module_name, _, attr = job["target"].partition(":")
+            target = getattr(importlib.import_module(module_name), attr)
+            if isinstance(target, type) and issubclass(target, SynchronousService):
+                if job.get("factory"):
+                    service = getattr(target, job["factory"])(job.get("config", {}))
+                else:
+                    service = target(**job.get("config", {}))
+                target = service.run_once
+            window = job.get("window")
+            scheduler.add_job(
+                job.get("name", job["target"]),
+                target,
+                every=job.get("every"),
+                cron=job.get("cron"),
+                jitter=job.get("jitter", 0.0),
+                run_now=job.get("run_now", False),
+                window=window and ActiveWindow.from_serializable(window),
+            )
+        return scheduler
+
+    def _run_job(self, job: Job):
+        try:
+            job.fn()
+        except Exception:
+            logger.exception(f"job {job.name} failed")
+        finally:
+            job.running = False
+
+    def run_forever(self):
+        self._executor = ThreadPoolExecutor(self.max_workers, "scheduler")
+        logger.info(f"scheduler started with {len(self.jobs)} jobs")
+        try:
+            while True:
+                with self._cond:
+                    while not self._stopped:
+                        if not self._heap:
+                            self._cond.wait()
+                            continue
+                        timeout = self._heap[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._cond.wait(timeout)
+                    if self._stopped:
+                        return
+                    _, _, job = heapq.heappop(self._heap)
+                    if self.jobs.get(job.name) is not job:
+                        continue  # removed since it was queued
+                    closed_for = job.window.seconds_until_active() if job.window else 0
+                    if closed_for:
+                        # sleep through the closed period, the schedule resumes
+                        # from when the window opens
+                        job.deadline = time.monotonic() + closed_for
+                        self._push(job)
+                        continue
+                    if job.running:
+                        logger.warning(f"job {job.name} still running, skipping run")
+                    else:
+                        job.running = True
+                        self._executor.submit(self._run_job, job)
+                    job.deadline = job.spec.next_after(job.deadline)
+                    self._push(job)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.run_forever, name="scheduler", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+# ~~~~~~~~~~~~~~~~ supervision ~~~~~~~~~~~~~~~~~~
+@dataclass
+class WorkerSpec:
+    name: str
+    factory: Callable[[], SynchronousService]  # must be picklable, e.g. a module
+    # level function or functools.partial, the service is built in the worker
+    interval: float
+    cpu_limit: Optional[int] = None  # cpu seconds per run, worker killed beyond it
+    wall_limit: Optional[float] = None  # seconds per run, worker killed beyond it
+
+
+class RunResult(NamedTuple):
+    service: str
+    pid: int
+    run: int
+    ok: bool
+    value: Any  # whatever run() returned, repr() of it if it does not pickle
+    error: Optional[str]
+    seconds: float
+    cpu_seconds: float
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _service_worker(spec: WorkerSpec, events, stopping):
+    """ worker process loop, runs the service on its own drift-free schedule and
+        reports ("start", name, run, pid, timestamp) and RunResult on events
+    """
+    service = spec.factory()
+    pid = os.getpid()
+    deadline = time.monotonic()
+    run = 0
+    exit_code = 0
+    try:
+        while not stopping.is_set():
+            run += 1
+            cpu_start = _cpu_seconds() if resource else 0.0
+            if resource and spec.cpu_limit:
+                # RLIMIT_CPU counts the whole process, so move the soft limit
+                # along with usage; SIGXCPU then kills the worker mid run
+                _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+                soft = int(cpu_start) + spec.cpu_limit + 1
+                resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+            events.put(("start", spec.name, run, pid, time.monotonic()))
+            start = time.perf_counter()
+            ok, value, error = True, None, None
+            try:
+                value = service.run_once()
+            except (Exception, SystemExit) as e:
+                ok, error = False, f"{e.__class__.__name__}: {e}"
+            try:
+                pickle.dumps(value)
+            except Exception:
+                value = repr(value)
+            seconds = time.perf_counter() - start
+            cpu = _cpu_seconds() - cpu_start if resource else 0.0
+            events.put(RunResult(spec.name, pid, run, ok, value, error, seconds, cpu))
+            if not ok:
+                exit_code = 1
+                break
+            deadline += spec.interval
+            now = time.monotonic()
+            if deadline < now:
+                deadline += ((now - deadline) // spec.interval + 1) * spec.interval
+            stopping.wait(deadline - now)
+    finally:
+        service.stop()
+    # sys.exit rather than os._exit so queued events are flushed first
+    sys.exit(exit_code)
+
+
+@dataclass
+class _Worker:
+    spec: WorkerSpec
+    process: Optional[multiprocessing.Process] = None
+    failures: int = 0
+    restart_at: float = 0.0
+    run_started: Optional[float] = None  # monotonic start of the run in flight
+
+
+class ServiceSupervisor:
+    """ Runs each service in its own worker process so a slow or crashing monitor
+        cannot hold up or take down the others, and CPU heavy ones use all cores.
+        A worker whose run fails, exceeds its cpu_limit (RLIMIT_CPU, posix only) or
+        wall_limit is stopped and restarted after an exponential backoff, reset
+        by the next successful run. Every finished run is put on results as a
+        RunResult, on_result is called for each as well.
+
+            supervisor = ServiceSupervisor()
+            supervisor.add("ps5", make_ps5_monitor, interval=300, wall_limit=120)
+            supervisor.start()
+    """
+
+    POLL_INTERVAL = 0.5
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 300.0
+    STOP_GRACE = 10.0  # seconds workers get to finish a run when stopping
+
+    def __init__(
+        self,
+        on_result: Optional[Callable[[RunResult], None]] = None,
+        start_method: Optional[str] = None,
+    ):
+        self.on_result = on_result
+        self.results: "queue.Queue[RunResult]" = queue.Queue()
+        self.workers: Dict[str, _Worker] = {}
+        self._ctx = multiprocessing.get_context(start_method)
+        self._events = self._ctx.Queue()
+        self._stopping = self._ctx.Event()
+
+    def add(
+        self,
+        name: str,
+        factory: Callable[[], SynchronousService],
+        interval: Optional[float] = None,
+        cpu_limit: Optional[int] = None,
+        wall_limit: Optional[float] = None,
+    ) -> WorkerSpec:
+        assert name not in self.workers, f"service {name} already supervised"
+        interval = interval or SynchronousService.DEFAULT_INTERVAL
+        spec = WorkerSpec(name, factory, interval, cpu_limit, wall_limit)
+        self.workers[name] = _Worker(spec)
+        return spec
+
+    def _spawn(self, worker: _Worker):
+        worker.process = self._ctx.Process(
+            target=_service_worker,
+            args=(worker.spec, self._events, self._stopping),
+            name=f"service-{worker.spec.name}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.run_started = None
+        logger.info(f"started {worker.spec.name} in pid {worker.process.pid}")
+
+    def _failed(self, worker: _Worker, reason: str):
+        backoff = min(self.BACKOFF_BASE * 2 ** worker.failures, self.BACKOFF_MAX)
+        worker.failures += 1
+        worker.restart_at = time.monotonic() + backoff
+        worker.process = None
+        logger.warning(f"{worker.spec.name} {reason}, restarting in {backoff:.1f}s")
+
+    def _handle_event(self, event):
+        if isinstance(event, RunResult):
+            worker = self.workers[event.service]
+            worker.run_started = None
+            if event.ok:
+                worker.failures = 0
+            else:
+                logger.error(f"{event.service} run {event.run} failed: {event.error}")
+            self.results.put(event)
+            if self.on_result:
+                self.on_result(event)
+        else:
+            _, name, _, pid, started = event
+            worker = self.workers[name]
+            if worker.process and worker.process.pid == pid:
+                worker.run_started = started
+
+    def _drain_events(self):
+        while True:
+            try:
+                self._handle_event(self._events.get_nowait())
+            except queue.Empty:
+                return
+
+    def _check(self, worker: _Worker):
+        process, spec = worker.process, worker.spec
+        now = time.monotonic()
+        if process is None:
+            if now >= worker.restart_at:
+                self._spawn(worker)
+        elif not process.is_alive():
+            process.join()
+            self._failed(worker, f"exited with code {process.exitcode}")
+        elif (
+            spec.wall_limit
+            and worker.run_started
+            and now - worker.run_started > spec.wall_limit
+        ):
+            process.kill()
+            process.join()
+            self._failed(worker, f"run exceeded {spec.wall_limit}s")
+
+    def run_forever(self):
+        logger.info(f"supervising {list(self.workers)}")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self._handle_event(self._events.get(timeout=self.POLL_INTERVAL))
+                    self._drain_events()
+                except queue.Empty:
+                    pass
+                if self._stopping.is_set():
+                    break  # workers exit on their own now, do not restart them
+                for worker in self.workers.values():
+                    self._check(worker)
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        self._stopping.set()
+        deadline = time.monotonic() + self.STOP_GRACE
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+        self._drain_events()  # results of runs that finished while shutting down
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.run_forever, name="service-supervisor", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopping.set()
@@ -1,11 +1,18 @@
+import hashlib
 import json
 import logging
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import requests
 from pydantic import BaseModel
 from twilio.rest import Client
 
+from tools.db_utils import SqliteClient, SqliteInfo
+from tools.http_client import HttpClient, RateLimiter, get_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,17 +83,40 @@ class TwilioTextSender:
     def from_creds_file(cls, file_loc: str):
         return cls(TwilioCreds.from_json_file(file_loc))
 
-    def send_message(self, message_body: str):
+    def send_message(self, message_body: str, to_number: Optional[str] = None):
         message = self.client.messages.create(
-            from_=self._creds.from_number, to=self._creds.to_number, body=message_body,
+            from_=self._creds.from_number,
+            to=to_number or self._creds.to_number,
+            body=message_body,
         )
         logger.info(f"message sent with {message.sid} with status {message.status}")
+        return message.sid
+
+
+class RowResult(NamedTuple):
+    index: int  # position of the row in the input
+    ok: bool
+    response: Optional[Dict]
+    error: Optional[str]
+    attempts: int
+
+
+class AddRowsStats(NamedTuple):
+    rows: int
+    failed: int
+    retries: int
+    seconds: float
+    rows_per_sec: float
 
 
 class SheetyHandler:
     """ uses sheety API to manage linked google sheets
     """
 
+    ADD_ROWS_WORKERS = 4
+    ADD_ROWS_RATE = 5.0  # requests per second
+    ADD_ROWS_ATTEMPTS = 3
+
     def __init__(self, sheety_creds: SheetyCreds):
         self._creds: SheetyCreds = sheety_creds
 
@@ -100,31 +130,344 @@ class SheetyHandler:
         return self._creds.sheets[sheet].sub_sheets
 
     @staticmethod
-    def get_sheet_data(sheet: str, sub_sheet: str, url: str, token: str):
+    def get_sheet_response(
+        sheet: str,
+        sub_sheet: str,
+        url: str,
+        token: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> requests.Response:
+        """ conditional when etag / last_modified are given, 304 if unchanged
+        """
         get_url = f"https://api.sheety.co/{url}/{sheet}/{sub_sheet}"
-        r = requests.get(url=get_url, headers={"Authorization": token})
+        headers = {"Authorization": token}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        r = get_client().get(get_url, headers=headers)
         r.raise_for_status()
+        return r
+
+    @staticmethod
+    def get_sheet_data(sheet: str, sub_sheet: str, url: str, token: str):
+        r = SheetyHandler.get_sheet_response(sheet, sub_sheet, url, token)
         return json.loads(r.text)
 
     @staticmethod
-    def add_row(sheet: str, sub_sheet: str, url: str, token: str, row: Dict):
+    def add_row(
+        sheet: str,
+        sub_sheet: str,
+        url: str,
+        token: str,
+        row: Dict,
+        client: Optional[HttpClient] = None,
+    ):
         post_url = f"https://api.sheety.co/{url}/{sheet}/{sub_sheet}"
-        r = requests.post(
-            url=post_url, headers={"Authorization": token}, json={"destination": row}
+        r = (client or get_client()).post(
+            post_url, headers={"Authorization": token}, json={"destination": row}
         )
         r.raise_for_status()
         return json.loads(r.text)
 
+    def default_sub_sheet(self, sheet: str) -> str:
+        return next(iter(self._get_all_subsheets(sheet)))
+
     def get_sheet(self, sheet: str, sub_sheet: Optional[str] = None):
-        sub_sheet = sub_sheet or next(iter(self._get_all_subsheets(sheet)))
+        sub_sheet = sub_sheet or self.default_sub_sheet(sheet)
         data = self.get_sheet_data(
             sheet, sub_sheet, self._creds.sheets[sheet].url, self._creds.token
         )
         logger.info(f"found sheet data for {sheet}/{sub_sheet}")
         return data[sub_sheet]
 
+    def get_sheet_if_changed(
+        self,
+        sheet: str,
+        sub_sheet: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        """ (rows, etag, last_modified), rows is None if the sheet is unchanged
+        """
+        r = self.get_sheet_response(
+            sheet,
+            sub_sheet,
+            self._creds.sheets[sheet].url,
+            self._creds.token,
+            etag,
+            last_modified,
+        )
+        if r.status_code == 304:
+            return None, etag, last_modified
+        rows = json.loads(r.text)[sub_sheet]
+        return rows, r.headers.get("ETag"), r.headers.get("Last-Modified")
+
     def add_row_to_sheet(self, sheet: str, sub_sheet: str, row: Dict):
         response = self.add_row(
             sheet, sub_sheet, self._creds.sheets[sheet].url, self._creds.token, row
         )
         logger.info(f"row {row} added to {sheet}/{sub_sheet} with response {response}")
+
+    def _add_row_with_retries(
+        self,
+        sheet: str,
+        sub_sheet: str,
+        index: int,
+        row: Dict,
+        limiter: Optional[RateLimiter],
+        max_attempts: int,
+        client: HttpClient,
+    ) -> RowResult:
+        """ client must not retry itself, so every attempt passes the limiter
+        """
+        url = self._creds.sheets[sheet].url
+        token = self._creds.token
+        for attempt in range(1, max_attempts + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self.add_row(sheet, sub_sheet, url, token, row, client)
+                return RowResult(index, True, response, None, attempt)
+            except Exception as e:
+                error = f"{e.__class__.__name__}: {e}"
+                if attempt < max_attempts:
+                    delay = None
+                    if isinstance(e, requests.HTTPError) and e.response is not None:
+                        delay = client.retry_after(e.response)
+                    if delay is None:
+                        delay = client.backoff(attempt)
+                    delay = min(delay, client.backoff_max)
+                    logger.warning(f"row {index} failed: {error}, retry {delay:.1f}s")
+                    time.sleep(delay)
+        logger.error(f"row {index} not added after {max_attempts} attempts: {error}")
+        return RowResult(index, False, None, error, max_attempts)
+
+    def add_rows(
+        self,
+        sheet: str,
+        sub_sheet: str,
+        rows: Iterable[Dict],
+        max_workers: int = ADD_ROWS_WORKERS,
+        rate: Optional[float] = ADD_ROWS_RATE,
+        max_attempts: int = ADD_ROWS_ATTEMPTS,
+    ) -> Tuple[List[RowResult], AddRowsStats]:
+        """ post rows concurrently from max_workers threads, at most rate requests
+            per second overall (None for no limit); a failed row is retried on its
+            own up to max_attempts times without holding up the others.
+            Results come back in input order, rows are consumed lazily so at most
+            a couple of batches of workers are in flight at once
+        """
+        limiter = RateLimiter(rate, burst=max_workers) if rate else None
+        # retries happen here, through the limiter, not inside the http client
+        client = HttpClient(pool_size=max_workers, max_retries=0)
+        in_flight = threading.BoundedSemaphore(max_workers * 2)
+        futures = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers, "sheety-add-rows") as executor:
+            for index, row in enumerate(rows):
+                in_flight.acquire()
+                future = executor.submit(
+                    self._add_row_with_retries,
+                    sheet,
+                    sub_sheet,
+                    index,
+                    row,
+                    limiter,
+                    max_attempts,
+                    client,
+                )
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+        results = [future.result() for future in futures]
+        client.close()
+        seconds = time.perf_counter() - start
+        failed = sum(not r.ok for r in results)
+        stats = AddRowsStats(
+            rows=len(results),
+            failed=failed,
+            retries=sum(r.attempts - 1 for r in results),
+            seconds=seconds,
+            rows_per_sec=len(results) / seconds if seconds else 0.0,
+        )
+        logger.info(
+            f"added {stats.rows - failed}/{stats.rows} rows to {sheet}/{sub_sheet} "
+            f"in {seconds:.1f}s ({stats.rows_per_sec:.1f} rows/s)"
+        )
+        return results, stats
+
+
+class RowChange(NamedTuple):
+    seq: int  # sync that saw the change
+    op: str  # "insert", "update" or "delete"
+    id: int
+    row: Optional[Dict]  # None once deleted
+
+
+class SheetDiff(NamedTuple):
+    seq: int
+    inserted: List[Dict]
+    updated: List[Dict]
+    deleted: List[int]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+class SheetyMirror:
+    """ Local sqlite mirror of sheety sub-sheets, so repeated reads stay local
+        A sub-sheet is fetched again at most once per ttl seconds, and then
+        conditionally when sheety sent an ETag / Last-Modified. Each sync that
+        fetches rows diffs them against the mirror by row id and content hash,
+        and tags every change with the sync's seq number, so callers can ask for
+        the rows changed since a sync they have seen.
+    """
+
+    DEFAULT_TTL = 300
+    ROWS_TABLE = "sheety_rows"
+    SYNCS_TABLE = "sheety_syncs"
+
+    def __init__(self, handler: SheetyHandler, db_file: str, ttl: float = DEFAULT_TTL):
+        self.handler = handler
+        self.ttl = ttl
+        self.client = SqliteClient.from_db_info(SqliteInfo(db_file))
+        self.client.db_conn.connect()
+        # seq is the sync that last changed a row, first_seq the one that added it
+        self.client.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.ROWS_TABLE} "
+            "(sheet text, sub_sheet text, id integer, data text, hash text, "
+            "seq integer, first_seq integer, deleted integer, "
+            "PRIMARY KEY (sheet, sub_sheet, id))"
+        )
+        self.client.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.SYNCS_TABLE} "
+            "(sheet text, sub_sheet text, seq integer, synced_at real, "
+            "etag text, last_modified text, PRIMARY KEY (sheet, sub_sheet))"
+        )
+
+    def close(self):
+        self.client.db_conn.disconnect()
+
+    @staticmethod
+    def _hash(row: Dict) -> str:
+        return hashlib.sha1(json.dumps(row, sort_keys=True).encode()).hexdigest()
+
+    def _sync_state(self, sheet: str, sub_sheet: str):
+        rows = self.client.fetch(
+            f"SELECT seq, synced_at, etag, last_modified FROM {self.SYNCS_TABLE} "
+            "WHERE sheet = ? AND sub_sheet = ?",
+            (sheet, sub_sheet),
+        )
+        return rows[0] if rows else (0, None, None, None)
+
+    def sync(
+        self, sheet: str, sub_sheet: Optional[str] = None, force: bool = False
+    ) -> SheetDiff:
+        """ refresh the mirror unless synced less than ttl seconds ago (or force)
+            returns what this sync changed, empty if nothing was fetched
+        """
+        sub_sheet = sub_sheet or self.handler.default_sub_sheet(sheet)
+        seq, synced_at, etag, last_modified = self._sync_state(sheet, sub_sheet)
+        now = time.time()
+        if not force and synced_at is not None and now - synced_at < self.ttl:
+            return SheetDiff(seq, [], [], [])
+        rows, etag, last_modified = self.handler.get_sheet_if_changed(
+            sheet, sub_sheet, etag, last_modified
+        )
+        if rows is None:
+            logger.info(f"{sheet}/{sub_sheet} not modified since last sync")
+            self.client.execute(
+                f"UPDATE {self.SYNCS_TABLE} SET synced_at = ? "
+                "WHERE sheet = ? AND sub_sheet = ?",
+                (now, sheet, sub_sheet),
+            )
+            return SheetDiff(seq, [], [], [])
+
+        seq += 1
+        known = {
+            row_id: (row_hash, deleted)
+            for row_id, row_hash, deleted in self.client.fetch(
+                f"SELECT id, hash, deleted FROM {self.ROWS_TABLE} "
+                "WHERE sheet = ? AND sub_sheet = ?",
+                (sheet, sub_sheet),
+            )
+        }
+        diff = SheetDiff(seq, [], [], [])
+        hashes = {}
+        for row in rows:
+            row_hash = hashes[row["id"]] = self._hash(row)
+            if row["id"] not in known or known[row["id"]][1]:
+                diff.inserted.append(row)
+            elif known[row["id"]][0] != row_hash:
+                diff.updated.append(row)
+        seen = {row["id"] for row in rows}
+        diff.deleted.extend(
+            row_id
+            for row_id, (_, deleted) in known.items()
+            if row_id not in seen and not deleted
+        )
+        with self.client.transaction():
+            for row in diff.inserted:
+                self.client.execute(
+                    f"INSERT OR REPLACE INTO {self.ROWS_TABLE} "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (sheet, sub_sheet, row["id"], json.dumps(row), hashes[row["id"]])
+                    + (seq, seq),
+                )
+            for row in diff.updated:
+                self.client.execute(
+                    f"UPDATE {self.ROWS_TABLE} SET data = ?, hash = ?, seq = ? "
+                    "WHERE sheet = ? AND sub_sheet = ? AND id = ?",
+                    (json.dumps(row), hashes[row["id"]], seq, sheet, sub_sheet)
+                    + (row["id"],),
+                )
+            for row_id in diff.deleted:
+                self.client.execute(
+                    f"UPDATE {self.ROWS_TABLE} SET deleted = 1, seq = ?, data = NULL "
+                    "WHERE sheet = ? AND sub_sheet = ? AND id = ?",
+                    (seq, sheet, sub_sheet, row_id),
+                )
+            self.client.execute(
+                f"INSERT OR REPLACE INTO {self.SYNCS_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                (sheet, sub_sheet, seq, now, etag, last_modified),
+            )
+        logger.info(
+            f"synced {sheet}/{sub_sheet} #{seq}: {len(diff.inserted)} inserted, "
+            f"{len(diff.updated)} updated, {len(diff.deleted)} deleted"
+        )
+        return diff
+
+    def get_sheet(self, sheet: str, sub_sheet: Optional[str] = None) -> List[Dict]:
+        """ drop-in for SheetyHandler.get_sheet, served from the mirror
+        """
+        sub_sheet = sub_sheet or self.handler.default_sub_sheet(sheet)
+        self.sync(sheet, sub_sheet)
+        rows = self.client.fetch(
+            f"SELECT data FROM {self.ROWS_TABLE} "
+            "WHERE sheet = ? AND sub_sheet = ? AND NOT deleted ORDER BY id",
+            (sheet, sub_sheet),
+        )
+        return [json.loads(data) for data, in rows]
+
+    def changes_since(
+        self, sheet: str, sub_sheet: Optional[str] = None, seq: int = 0
+    ) -> List[RowChange]:
+        """ latest change of every row changed by syncs after seq, syncs first
+        """
+        sub_sheet = sub_sheet or self.handler.default_sub_sheet(sheet)
+        self.sync(sheet, sub_sheet)
+        changes = []
+        for change_seq, first_seq, row_id, data in self.client.fetch(
+            f"SELECT seq, first_seq, id, data FROM {self.ROWS_TABLE} "
+            "WHERE sheet = ? AND sub_sheet = ? AND seq > ? ORDER BY seq, id",
+            (sheet, sub_sheet, seq),
+        ):
+            if data is None:
+                changes.append(RowChange(change_seq, "delete", row_id, None))
+            else:
+                # a row added after seq is new to the caller, even if since updated
+                op = "insert" if first_seq > seq else "update"
+                changes.append(RowChange(change_seq, op, row_id, json.loads(data)))
+        return changes